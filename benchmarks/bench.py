@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# pylint: disable=missing-docstring,invalid-name
+"""
+    Benchmarks for the hot paths of strazar. No network access is needed,
+    all inputs are synthetic.
+
+    For every benchmark the best wall clock time, the peak memory and the
+    number of memory blocks still allocated afterwards are reported and
+    compared against benchmarks/baseline.json. A benchmark which is slower,
+    uses more memory or leaves more blocks allocated than its baseline plus
+    tolerance fails and the script exits with a non-zero status.
+
+    Usage:
+        python benchmarks/bench.py              # run and compare
+        python benchmarks/bench.py --quick      # skip the largest inputs
+        python benchmarks/bench.py --save       # store new baselines
+        python benchmarks/bench.py -k feed      # only matching benchmarks
+
+    Timings depend on the machine, re-create the baselines with --save
+    when moving to a different one. That's also why CI doesn't run them.
+"""
+import gc
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from contextlib import redirect_stdout
+from io import BytesIO
+from itertools import product
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import strazar  # noqa: E402 pylint: disable=wrong-import-position
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# (packages, versions per package) -> rows in the env matrix
+MATRIX_SIZES = {
+    10: (2, [5, 2]),
+    1000: (3, [10, 10, 10]),
+    100000: (5, [10, 10, 10, 10, 10]),
+}
+FEED_SIZES = [40, 1000, 100000]
+QUICK_LIMIT = 1000
+
+# absolute slack so that tiny benchmarks don't fail because of noise
+TIME_SLACK = 0.001
+MEMORY_SLACK_KIB = 16
+BLOCKS_SLACK = 64
+
+
+def make_travis(rows):
+    _, versions = MATRIX_SIZES[rows]
+    pools = [['_PKG%d=%d.%d' % (p, p, v) for v in range(count)]
+             for p, count in enumerate(versions)]
+    return {
+        'language': 'python',
+        'env': [' '.join(line) for line in product(*pools)],
+    }
+
+
+def make_feed(items):
+    parts = [b'<?xml version="1.0" encoding="UTF-8"?>\n'
+             b'<rss version="0.91">\n <channel>\n'
+             b'  <title>PyPI Recent Updates</title>\n']
+    for i in range(items):
+        parts.append((
+            '  <item>\n'
+            '    <title>package-%d 1.%d</title>\n'
+            '    <link>http://pypi.python.org/pypi/package-%d/1.%d</link>\n'
+            '    <description>Synthetic package number %d</description>\n'
+            '    <pubDate>15 May 2016 %02d:%02d:%02d GMT</pubDate>\n'
+            '  </item>\n' % (i, i, i, i, i, 23 - (i // 3600) % 24,
+                             59 - (i // 60) % 60, 59 - i % 60)
+        ).encode('UTF-8'))
+    parts.append(b' </channel>\n</rss>\n')
+    return b''.join(parts)
+
+
+def benchmarks(quick=False):
+    """
+        Yield (name, setup, function) tuples. setup() is executed before
+        every measurement and returns the arguments for function().
+    """
+    for rows in sorted(MATRIX_SIZES):
+        if quick and rows > QUICK_LIMIT:
+            continue
+        travis = make_travis(rows)
+        groups = strazar.build_travis_env(travis, 'PKG0', '0.99')
+
+        yield ('build_travis_env[%d]' % rows,
+               lambda t=travis: (t, 'PKG0', '0.99'),
+               strazar.build_travis_env)
+        yield ('calculate_new_travis_env[%d]' % rows,
+               lambda g=groups: (g,),
+               strazar.calculate_new_travis_env)
+        yield ('update_travis[%d]' % rows,
+               lambda t=travis: (t, 'PKG0', '0.99'),
+               strazar.update_travis)
+        yield ('update_travis_incremental[%d]' % rows,
+               lambda t=travis: (t, 'PKG0', '0.99'),
+               strazar.update_travis_incremental)
+
+    for items in FEED_SIZES:
+        if quick and items > QUICK_LIMIT:
+            continue
+        feed = make_feed(items)
+        matcher = strazar.PackageMatcher({
+            'django-*': [{'cb': lambda **kwargs: None, 'args': {}}],
+        })
+
+        yield ('monitor_pypi_rss[%d]' % items,
+               lambda f=feed, m=matcher: (m, BytesIO(f)),
+               _quiet_monitor)
+
+
+def _quiet_monitor(config, feed):
+    with open(os.devnull, 'w') as devnull:
+        with redirect_stdout(devnull):
+            strazar.monitor_pypi_rss(config, feed)
+
+
+def measure(setup, function, repeat):
+    best = None
+    for _ in range(repeat):
+        args = setup()
+        # like timeit, keep the garbage collector out of the timings
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            function(*args)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+
+    args = setup()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    result = function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    blocks = sys.getallocatedblocks() - blocks
+    del result
+
+    return {
+        'time': best,
+        'peak_kib': peak / 1024.0,
+        'blocks': blocks,
+    }
+
+
+def compare(name, result, baseline, time_tolerance, memory_tolerance,
+            blocks_tolerance):
+    """
+        @return - list of strings describing regressions
+    """
+    if name not in baseline:
+        return []
+
+    problems = []
+    expected = baseline[name]
+    if result['time'] > expected['time'] * time_tolerance + TIME_SLACK:
+        problems.append("time %.4f s > baseline %.4f s" %
+                        (result['time'], expected['time']))
+    if (result['peak_kib'] >
+            expected['peak_kib'] * memory_tolerance + MEMORY_SLACK_KIB):
+        problems.append("peak memory %.1f KiB > baseline %.1f KiB" %
+                        (result['peak_kib'], expected['peak_kib']))
+    if result['blocks'] > expected['blocks'] * blocks_tolerance + BLOCKS_SLACK:
+        problems.append("%d blocks > baseline %d blocks" %
+                        (result['blocks'], expected['blocks']))
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--quick', action='store_true',
+                        help='skip inputs larger than %d' % QUICK_LIMIT)
+    parser.add_argument('-k', dest='keyword', default='',
+                        help='only run benchmarks containing KEYWORD')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--time-tolerance', type=float, default=2.0)
+    parser.add_argument('--memory-tolerance', type=float, default=1.2)
+    parser.add_argument('--blocks-tolerance', type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    failures = 0
+    print("%-36s %10s %12s %10s" % ('benchmark', 'time [s]', 'peak [KiB]',
+                                    'blocks'))
+    for name, setup, function in benchmarks(args.quick):
+        if args.keyword not in name:
+            continue
+
+        result = results[name] = measure(setup, function, args.repeat)
+        problems = compare(name, result, baseline, args.time_tolerance,
+                           args.memory_tolerance, args.blocks_tolerance)
+        print("%-36s %10.4f %12.1f %10d %s" % (
+            name, result['time'], result['peak_kib'], result['blocks'],
+            'REGRESSION: ' + ', '.join(problems) if problems else ''))
+        failures += bool(problems)
+
+    if args.save:
+        baseline.update(results)
+        with open(BASELINE, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=4, sort_keys=True)
+        print("baseline saved to %s" % BASELINE)
+        return 0
+
+    if failures:
+        print("%d benchmark(s) regressed" % failures)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
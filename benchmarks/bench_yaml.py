@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# pylint: disable=missing-docstring,invalid-name
+"""
+    Compare YAML round-tripping of a large .travis.yml with the pure
+    Python and the libyaml based loader/dumper.
+
+    Usage: python benchmarks/bench_yaml.py [rows]
+"""
+import sys
+import timeit
+
+import yaml
+
+
+def make_travis(rows):
+    return {
+        'language': 'python',
+        'python': ['2.7', '3.5', '3.6'],
+        'install': ['pip install PyYAML==$_PYYAML Django==$_DJANGO'],
+        'script': ['./test.sh'],
+        'env': ['_DJANGO=1.%d _PYYAML=3.%d _BOTO=2.%d' % (i % 50, i % 7, i)
+                for i in range(rows)],
+        'matrix': {
+            'allow_failures': [{'env': '_DJANGO=1.%d' % i}
+                               for i in range(rows // 10)],
+        },
+    }
+
+
+def round_trip(text, loader, dumper):
+    return yaml.dump(yaml.load(text, Loader=loader), Dumper=dumper,
+                     default_flow_style=False)
+
+
+def main(rows=10000, repeat=5):
+    text = yaml.dump(make_travis(rows), default_flow_style=False)
+    print("%d env rows, %d bytes" % (rows, len(text)))
+
+    implementations = [('pure Python', yaml.SafeLoader, yaml.SafeDumper)]
+    if yaml.__with_libyaml__:
+        implementations.append(('libyaml', yaml.CSafeLoader,
+                                yaml.CSafeDumper))
+    else:
+        print("PyYAML was built without libyaml")
+
+    outputs = set()
+    for name, loader, dumper in implementations:
+        outputs.add(round_trip(text, loader, dumper))
+        best = min(timeit.repeat(lambda: round_trip(text, loader, dumper),
+                                 number=1, repeat=repeat))
+        print("%-12s %8.3f s" % (name, best))
+
+    assert len(outputs) == 1, "implementations produce different output"
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
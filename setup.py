@@ -23,9 +23,19 @@ config = {
         'License :: OSI Approved :: BSD License',
         'Operating System :: OS Independent',
         'Programming Language :: Python',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
     ],
+    'python_requires' : '>=3.5',
     'zip_safe' : False,
     'install_requires' : ['PyYAML'],
+    'extras_require' : {
+        'retention' : ['packaging'],
+        'orjson' : ['orjson'],
+    },
+    'entry_points' : {
+        'console_scripts' : ['strazar = strazar.cli:main'],
+    },
 }
 
 setup(**config)
@@ -0,0 +1,8 @@
+"""
+    python -m strazar, see strazar.cli
+"""
+import sys
+
+from strazar.cli import main
+
+sys.exit(main())
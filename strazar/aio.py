@@ -0,0 +1,222 @@
+# pylint: disable=missing-docstring,invalid-name,protected-access
+"""
+    asyncio versions of get_url(), update_github() and monitor_pypi_rss()
+    built on non-blocking sockets. They share the request preparation,
+    caching and GitHub update logic with their blocking counterparts.
+
+    Usage::
+
+        import asyncio
+        from strazar.aio import monitor_pypi_rss_async, update_github_async
+
+        config = {
+            "PyYAML" : [
+                {
+                    'cb' : update_github_async,
+                    'args': {...}
+                },
+            ],
+        }
+        asyncio.get_event_loop().run_until_complete(
+            monitor_pypi_rss_async(config, concurrency=100))
+"""
+import ssl
+import time
+import asyncio
+from functools import partial
+
+from strazar import github, net, pypi, stats
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    status = int(status_line.split(b' ', 2)[1])
+
+    headers = []
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, value = line.decode('latin-1').split(':', 1)
+        headers.append((name.strip(), value.strip()))
+    lower_headers = dict((k.lower(), v) for k, v in headers)
+
+    decoder = net.ContentDecoder(lower_headers.get('content-encoding'))
+    chunks = []
+    if lower_headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # skip trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(decoder.decode(await reader.readexactly(size)))
+            await reader.readline()
+    else:
+        remaining = int(lower_headers.get('content-length', -1))
+        while remaining != 0:
+            if remaining > 0:
+                chunk = await reader.read(min(remaining, net.CHUNK_SIZE))
+                remaining -= len(chunk)
+            else:
+                chunk = await reader.read(net.CHUNK_SIZE)
+            if not chunk:
+                if remaining > 0:
+                    raise asyncio.IncompleteReadError(b''.join(chunks),
+                                                      remaining)
+                break
+            chunks.append(decoder.decode(chunk))
+    chunks.append(decoder.flush())
+
+    return status, headers, b''.join(chunks), decoder.received
+
+
+async def _send_request(request, timeout):
+    host, _, port = request['host_port'].partition(':')
+    use_ssl = request['scheme'] == 'https'
+    if port:
+        port = int(port)
+    else:
+        port = 443 if use_ssl else 80
+
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(
+            host, port, ssl=ssl.create_default_context() if use_ssl else None),
+        timeout)
+    try:
+        body = request['body'] or b''
+
+        headers = dict(request['headers'])
+        headers.update({
+            'Host': request['host_port'],
+            'Connection': 'close',
+            'Content-Length': str(len(body)),
+        })
+        lines = ['%s %s HTTP/1.1' % (request['method'], request['path'])]
+        lines.extend(['%s: %s' % item for item in headers.items()])
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        writer.write(body)
+        await writer.drain()
+
+        return await asyncio.wait_for(_read_response(reader), timeout)
+    finally:
+        writer.close()
+
+
+async def get_url_async(url, post_data=None, timeout=30, compress=False,
+                        raw=False, stream=False):
+    """
+        Same as strazar.get_url() but doesn't block the event loop.
+        One connection is used per request.
+    """
+    # pylint: disable=too-many-arguments
+    request = net._prepare_request(url, post_data, compress, raw, stream)
+    host = request['host_port']
+    for attempt in range(net._limiter.max_retries + 1):
+        wait = net._limiter.delay(host)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        started = time.time()
+        status, response_headers, data, received = await _send_request(
+            request, timeout)
+        stats.record_request(request, started, received)
+        if not net._limiter.update(host, status, response_headers) or \
+                attempt == net._limiter.max_retries:
+            break
+        print("rate limited by %s, deferring request to %s" % (host, url))
+    return net._finish_request(request, status, response_headers, data)
+
+
+async def post_url_async(url, data, compress=False):
+    return await get_url_async(url, data, compress=compress)
+
+
+async def _fetch_async(url, post_data, compress):
+    try:
+        if post_data is None:
+            return await get_url_async(url), None
+        return await post_url_async(url, post_data, compress=compress), None
+    except Exception as e:  # pylint: disable=broad-except
+        return None, e
+
+
+async def _run_steps_async(steps, compress=False):
+    """
+        Asynchronous version of strazar.github._run_steps()
+    """
+    steps = github._retrying_steps(
+        steps, (net.ServerError, OSError, asyncio.TimeoutError))
+
+    outcome = None
+    while True:
+        try:
+            url, post_data, delay = steps.send(outcome)
+            if delay:
+                await asyncio.sleep(delay)
+        except StopIteration as stop:
+            return stop.value
+        outcome = await _fetch_async(url, post_data, compress)
+
+
+async def update_github_async(**kwargs):
+    """
+        Same as strazar.update_github() but doesn't block the event loop.
+    """
+    return await _run_steps_async(github._update_github_steps(**kwargs),
+                                  kwargs.get('compress', False))
+
+
+async def monitor_pypi_rss_async(config, feed=None, state_file=None,
+                                 batch=False, concurrency=100):
+    """
+        Same as strazar.monitor_pypi_rss() but callbacks are executed
+        concurrently on the event loop.
+
+        @concurrency - int - max number of callbacks executing at once.
+                Callbacks for the same GITHUB_REPO/GITHUB_BRANCH are
+                always executed one at a time.
+
+        Coroutine functions, e.g. update_github_async, are awaited. Plain
+        callbacks are executed in the default executor.
+    """
+    if feed is None:
+        print("fetching RSS info from PyPI")
+        feed = await get_url_async(pypi.PYPI_RSS_URL, stream=True)
+
+    loop = asyncio.get_event_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    locks = {}
+
+    async def _execute_callback(cfg, extra_args):
+        result = pypi._new_result(cfg, extra_args)
+        args = result['args']
+
+        lock = locks.setdefault(pypi._target(args), asyncio.Lock())
+        async with lock:
+            async with semaphore:
+                started = time.time()
+                try:
+                    if asyncio.iscoroutinefunction(cfg['cb']):
+                        result['result'] = await cfg['cb'](**args)
+                    else:
+                        result['result'] = await loop.run_in_executor(
+                            None, partial(cfg['cb'], **args))
+                except Exception as e:  # pylint: disable=broad-except
+                    print(e)
+                    result['error'] = e
+                stats.record_callback(result, started)
+        return result
+
+    newest, matched = [], {}
+    with github.repository_snapshots():
+        releases = pypi._rss_releases(
+            feed, pypi._load_cursor(state_file), newest)
+        tasks = [asyncio.ensure_future(_execute_callback(cfg, extra_args))
+                 for cfg, extra_args in pypi._pending_callbacks(
+                     config, releases, batch, matched=matched)]
+        results = list(await asyncio.gather(*tasks))
+
+    pypi._finish_rss_monitoring(results, state_file, newest, matched)
+    return results
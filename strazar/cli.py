@@ -0,0 +1,205 @@
+# pylint: disable=missing-docstring,invalid-name
+"""
+    The ``strazar`` command line tool.
+
+    Usage::
+
+        strazar run mymodule:config --state-file state.json
+        strazar run /etc/strazar/config.py --dry-run
+        strazar daemon mymodule:config --interval 600 --changelog
+        strazar matrix .travis.yml Django 1.10 --strength 2
+
+    The configuration is the same dict passed to monitor_pypi_rss(). It is
+    read from the 'config' variable of a Python file or from
+    'module:variable'.
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+
+import strazar
+
+
+def load_config(spec):
+    """
+        Load the configuration from @spec, a path to a Python file or
+        'module:variable'. The variable defaults to 'config'.
+    """
+    if spec.endswith('.py'):
+        import runpy
+        return runpy.run_path(spec)['config']
+
+    import importlib
+    module, _, variable = spec.partition(':')
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    return getattr(importlib.import_module(module), variable or 'config')
+
+
+def dry_run_config(config):
+    """
+        Returns a copy of @config where every callback only prints what
+        it would do instead of doing it.
+    """
+    wrappers = {}
+
+    def _wrap(cb):
+        if cb not in wrappers:
+            def _dry_run(**kwargs):
+                print("dry-run: %s(%s)" % (
+                    getattr(cb, '__name__', cb),
+                    ', '.join(['%s=%r' % item
+                               for item in sorted(kwargs.items())])))
+            wrappers[cb] = _dry_run
+        return wrappers[cb]
+
+    return dict((name, [dict(cfg, cb=_wrap(cfg['cb'])) for cfg in callbacks])
+                for name, callbacks in config.items())
+
+
+def _monitor_args(args):
+    monitor_args = {
+        'state_file': args.state_file,
+        'workers': args.workers,
+        'batch': args.batch,
+    }
+    if args.changelog:
+        monitor_args['monitor'] = strazar.monitor_pypi_changelog
+    elif args.feed:
+        monitor_args['feed'] = args.feed
+    return monitor_args
+
+
+def _strength(value):
+    strength = int(value)
+    if strength < 1:
+        raise argparse.ArgumentTypeError(
+            "strength must be at least 1, got %d" % strength)
+    return strength
+
+
+def _configure(args):
+    if args.cache_dir:
+        strazar.configure_http_cache(args.cache_dir)
+
+
+def _run(args):
+    _configure(args)
+    config = load_config(args.config)
+    monitor_args = _monitor_args(args)
+    monitor = monitor_args.pop('monitor', strazar.monitor_pypi_rss)
+
+    tmp_dir = None
+    if args.dry_run:
+        config = dry_run_config(config)
+        if args.state_file:
+            # read the previous state but leave the original untouched
+            tmp_dir = tempfile.mkdtemp()
+            monitor_args['state_file'] = os.path.join(tmp_dir, 'state.json')
+            if os.path.exists(args.state_file):
+                shutil.copy(args.state_file, monitor_args['state_file'])
+
+    try:
+        results = monitor(config, **monitor_args)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+        if args.metrics_file:
+            strazar.metrics.write(args.metrics_file)
+
+    return 1 if [r for r in results if r['error'] is not None] else 0
+
+
+def _daemon(args):
+    _configure(args)
+    strazar.run_daemon(load_config(args.config), interval=args.interval,
+                       jitter=args.jitter, metrics_file=args.metrics_file,
+                       **_monitor_args(args))
+    return 0
+
+
+def _matrix(args):
+    with open(args.travis_file) as travis_file:
+        travis = strazar.load_yaml(travis_file)
+
+    new_travis = strazar.update_travis(travis, args.package, args.version,
+                                       incremental=args.incremental,
+                                       strength=args.strength)
+    # rows are compared by their variables, their order doesn't matter
+    old_env = {frozenset(line.split()) for line in travis['env']}
+    new_env = {frozenset(line.split()) for line in new_travis['env']}
+    for line in new_travis['env']:
+        print("%s %s" % (' ' if frozenset(line.split()) in old_env else '+',
+                         line))
+    for line in travis['env']:
+        if frozenset(line.split()) not in new_env:
+            print("- %s" % line)
+    print("%d rows before, %d rows after" % (len(travis['env']),
+                                             len(new_travis['env'])))
+    return 0
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='strazar', description='Automatic upstream dependency testing')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    monitor_parent = argparse.ArgumentParser(add_help=False)
+    monitor_parent.add_argument(
+        'config', help="Python file or module:variable with the configuration")
+    monitor_parent.add_argument('--state-file',
+                                help="remember the last release seen here")
+    monitor_parent.add_argument('--changelog', action='store_true',
+                                help="read the PyPI changelog instead of RSS")
+    monitor_parent.add_argument('--workers', type=int, default=0,
+                                help="execute callbacks in this many threads")
+    monitor_parent.add_argument('--batch', action='store_true',
+                                help="one commit per repository and file")
+    monitor_parent.add_argument('--metrics-file',
+                                help="write metrics here, see Metrics.write()")
+    monitor_parent.add_argument(
+        '--cache-dir', help="cache GitHub responses in this directory")
+
+    run = commands.add_parser('run', parents=[monitor_parent],
+                              help="check PyPI once")
+    run.add_argument('--feed', help="read the RSS feed from this file")
+    run.add_argument('--dry-run', action='store_true',
+                     help="print the callbacks instead of executing them")
+    run.set_defaults(func=_run)
+
+    daemon = commands.add_parser('daemon', parents=[monitor_parent],
+                                 help="keep checking PyPI")
+    daemon.add_argument('--interval', type=float, default=3600,
+                        help="seconds between two polls")
+    daemon.add_argument('--jitter', type=float, default=0.1,
+                        help="randomize the interval by this fraction")
+    daemon.set_defaults(func=_daemon, feed=None)
+
+    matrix = commands.add_parser(
+        'matrix', help="preview the env matrix for a new version")
+    matrix.add_argument('travis_file', help="path to .travis.yml")
+    matrix.add_argument('package')
+    matrix.add_argument('version')
+    matrix.add_argument('--incremental', action='store_true',
+                        help="only add rows with the new version")
+    matrix.add_argument('--strength', type=_strength,
+                        help="build a t-way covering array")
+    matrix.set_defaults(func=_matrix)
+
+    return parser
+
+
+def main(argv=None):
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if args.command == 'run' and args.changelog and not args.state_file:
+        # a single run without a serial only records the current one
+        parser.error("--changelog requires --state-file")
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# pylint: disable=missing-docstring,invalid-name
+"""
+    Long running PyPI monitor.
+"""
+import os
+import signal
+import threading
+
+from strazar import net
+from strazar.pypi import monitor_pypi_rss
+from strazar.stats import metrics
+
+
+class Daemon(object):
+    """
+        Long running alternative to executing monitor_pypi_rss() from
+        cron. Keep-alive connections and the HTTP cache, see
+        configure_http_cache(), are reused between polls.
+
+        Without a state_file in @monitor_args the RSS cursor or the
+        changelog serial is kept in a temporary file for as long as the
+        daemon runs so that every poll continues where the previous one
+        stopped.
+
+        @config - see monitor_pypi_rss()
+        @interval - float - seconds between two polls
+        @jitter - float - the interval is randomized by this fraction
+                so that many daemons don't poll PyPI at the same time
+        @monitor - callable executed on every poll, monitor_pypi_rss
+                by default. Use monitor_pypi_changelog to never miss a
+                release.
+        @metrics_file - optional path the metrics are written to after
+                every poll, see Metrics.write()
+        @monitor_args - passed to @monitor, e.g. state_file or workers.
+                @monitor has to accept state_file.
+
+        SIGTERM and SIGINT stop the daemon once the current poll,
+        including all of its update_github() calls, has finished.
+    """
+    def __init__(self, config, interval=3600, jitter=0.1, monitor=None,
+                 metrics_file=None, **monitor_args):
+        self.config = config
+        self.interval = interval
+        self.jitter = jitter
+        self.monitor = monitor or monitor_pypi_rss
+        self.metrics_file = metrics_file
+        self.monitor_args = monitor_args
+        self._stopped = threading.Event()
+
+    def next_delay(self):
+        import random
+        return self.interval * random.uniform(1 - self.jitter,
+                                              1 + self.jitter)
+
+    def stop(self, *args):  # pylint: disable=unused-argument
+        self._stopped.set()
+
+    def poll(self):
+        try:
+            return self.monitor(self.config, **self.monitor_args)
+        except Exception as e:  # pylint: disable=broad-except
+            # try again on the next poll
+            print("ERROR when polling PyPI")
+            print(e)
+            return None
+        finally:
+            if self.metrics_file:
+                metrics.write(self.metrics_file)
+
+    def run(self, handle_signals=True):
+        """
+            Poll until stop() is called or a signal is received.
+            Signal handlers can only be installed from the main thread,
+            pass @handle_signals=False otherwise.
+
+            @return - int - the number of polls
+        """
+        previous = {}
+        if handle_signals:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                previous[signum] = signal.signal(signum, self.stop)
+
+        state_dir = None
+        if not self.monitor_args.get('state_file'):
+            import tempfile
+            state_dir = tempfile.mkdtemp(prefix='strazar-')
+            self.monitor_args['state_file'] = os.path.join(state_dir,
+                                                           'state.json')
+
+        polls = 0
+        try:
+            while not self._stopped.is_set():
+                self.poll()
+                polls += 1
+                self._stopped.wait(self.next_delay())
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+            net.close_connections()
+            if state_dir is not None:
+                import shutil
+                del self.monitor_args['state_file']
+                shutil.rmtree(state_dir)
+        print("stopped after %d polls" % polls)
+        return polls
+
+
+def run_daemon(config, **kwargs):
+    """
+        Shortcut for Daemon(config, **kwargs).run()
+    """
+    return Daemon(config, **kwargs).run()
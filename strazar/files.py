@@ -0,0 +1,30 @@
+# pylint: disable=missing-docstring,invalid-name
+"""
+    File helpers shared by the other modules.
+"""
+import os
+import threading
+
+
+def write_atomic(path, data):
+    """
+        Replace the file at @path with @data, a string or bytes. The data
+        is written to a temporary file in the same directory which is
+        then renamed, so readers never see a partially written file. The
+        temporary name is unique per process and thread so concurrent
+        writers, e.g. a daemon and a cron job sharing a state file, don't
+        overwrite each other's temporary file.
+    """
+    directory, name = os.path.split(path)
+    tmp_file = os.path.join(directory, '.%s.%d.%d.tmp' % (
+        name, os.getpid(), threading.current_thread().ident))
+    try:
+        with open(tmp_file, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        os.rename(tmp_file, path)
+    except Exception:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,527 @@
+# pylint: disable=missing-docstring,invalid-name
+"""
+    Committing .travis.yml changes through the GitHub API.
+"""
+import os
+import json
+import base64
+import threading
+import time
+from contextlib import contextmanager
+
+from strazar import net
+from strazar.files import write_atomic
+from strazar.net import NotFound, ServerError
+from strazar.travis import dump_yaml, load_yaml, patch_travis_env, \
+    update_travis
+
+
+# number of retries and the base delay in seconds of the exponential backoff
+RETRY_ATTEMPTS = 4
+RETRY_BACKOFF = 1
+RETRY_MAX_DELAY = 60
+
+
+class RepositorySnapshots(object):
+    """
+        Run-scoped cache of the files update_github() reads, keyed by
+        (GITHUB_REPO, GITHUB_BRANCH, GITHUB_FILE). Each snapshot holds
+        the HEAD commit sha, its tree sha, the file contents and the
+        parsed YAML so that
+        callbacks targeting the same file read it from GitHub only once.
+
+        Snapshots are updated in place when strazar pushes a new commit
+        and are never used across runs because somebody else may push
+        to the repository in the mean time.
+    """
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._snapshots.get(key)
+
+    def set(self, key, commit, tree, travis, text):
+        with self._lock:
+            self._snapshots[key] = {
+                'commit': commit,
+                'tree': tree,
+                'travis': travis,
+                'text': text,
+            }
+
+    def invalidate(self, repo, branch):
+        with self._lock:
+            for key in list(self._snapshots.keys()):
+                if key[:2] == (repo, branch):
+                    del self._snapshots[key]
+
+
+_snapshots = None
+
+
+@contextmanager
+def repository_snapshots():
+    """
+        Share a RepositorySnapshots instance between all update_github()
+        calls made inside the with block. monitor_pypi_rss() does this
+        for every run.
+    """
+    global _snapshots  # pylint: disable=global-statement
+    previous, _snapshots = _snapshots, RepositorySnapshots()
+    try:
+        yield _snapshots
+    finally:
+        _snapshots = previous
+
+
+class WriteJournal(object):
+    """
+        Remembers the blob, tree and commit update_github() created for
+        every (GITHUB_REPO, GITHUB_BRANCH, GITHUB_FILE) until the branch
+        has been updated. If a run fails half way the next one resumes
+        from the last object created instead of creating them again.
+
+        Entries are only reused for the same parent commit and the same
+        new file contents. They are stored as JSON in @path, or kept in
+        memory if @path is None.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as journal_file:
+                self._entries = json.load(journal_file)
+
+    @staticmethod
+    def _key(key):
+        return '/'.join(key)
+
+    def _save(self):
+        if self.path is None:
+            return
+        write_atomic(self.path, json.dumps(self._entries, indent=4,
+                                           sort_keys=True))
+
+    def get(self, key, parent, digest):
+        """
+            Returns a dict with the 'blob', 'tree' and 'commit' shas
+            created so far, possibly empty.
+        """
+        with self._lock:
+            entry = self._entries.get(self._key(key))
+            if entry is None or entry['parent'] != parent or \
+                    entry['digest'] != digest:
+                return {}
+            return dict(entry['created'])
+
+    def record(self, key, parent, digest, kind, sha):
+        with self._lock:
+            entry = self._entries.get(self._key(key))
+            if entry is None or entry['parent'] != parent or \
+                    entry['digest'] != digest:
+                entry = {'parent': parent, 'digest': digest, 'created': {}}
+                self._entries[self._key(key)] = entry
+            entry['created'][kind] = sha
+            self._save()
+
+    def remove(self, key):
+        with self._lock:
+            if self._entries.pop(self._key(key), None) is not None:
+                self._save()
+
+
+_journal = WriteJournal()
+
+
+def configure_write_journal(path):
+    """
+        Keep the WriteJournal in the file @path so that update_github()
+        can resume across runs. Pass path=None to keep it in memory.
+    """
+    global _journal  # pylint: disable=global-statement
+    _journal = WriteJournal(path)
+    return _journal
+
+
+def _commit_message(updates, github_file):
+    if len(updates) == 1:
+        return "New dependency %s %s found! Auto update %s" % (
+            updates[0][0], updates[0][1], github_file)
+
+    return "New dependencies %s found! Auto update %s" % (
+        ', '.join(["%s %s" % update for update in updates]), github_file)
+
+
+def _read_github_file_steps(GITHUB_REPO, GITHUB_BRANCH, GITHUB_FILE):
+    """
+        Walk ref -> commit -> tree -> blob to read GITHUB_FILE.
+
+        Like all *_steps functions this is a generator which yields
+        (url, post_data) tuples and expects the response to be sent back.
+        See _run_steps().
+
+        @return - tuple (HEAD, contents) where HEAD is a dict with
+                  the 'commit' and 'tree' shas the file was read from
+    """
+    # step 1: Get a reference to HEAD
+    data = yield ("/repos/%s/git/refs/heads/%s" %
+                  (GITHUB_REPO, GITHUB_BRANCH), None)
+    HEAD = {
+        'sha': data['object']['sha'],
+        'url': data['object']['url'],
+    }
+
+    # step 2: Grab the commit that HEAD points to
+    data = yield (HEAD['url'], None)
+    HEAD['commit'] = data
+
+    # step 4: Get a hold of the tree that the commit points to
+    data = yield (HEAD['commit']['tree']['url'], None)
+    HEAD['tree'] = {'sha': data['sha']}
+
+    # intermediate step: get the latest content from GitHub
+    # and make an updated version of .travis.yml
+    github_file_found = False
+    for obj in data['tree']:
+        if obj['path'] == GITHUB_FILE:
+            data = yield (obj['url'], None)  # get the blob from the tree
+            data = base64.b64decode(data['content'])
+            github_file_found = True
+            break
+
+    if not github_file_found:
+        raise RuntimeError("Repository %s doesn't contain a file named '%s'!" %
+                           (GITHUB_REPO, GITHUB_FILE))
+
+    return HEAD, data
+
+
+def _read_github_file_fast_steps(GITHUB_REPO, GITHUB_BRANCH, GITHUB_FILE):
+    """
+        Same as _read_github_file_steps() but with two requests: the commit
+        which GITHUB_BRANCH points to and the file contents at that
+        commit. The tree listing is never downloaded.
+    """
+    from urllib.parse import quote
+    data = yield ("/repos/%s/commits/%s" %
+                  (GITHUB_REPO, quote(GITHUB_BRANCH, safe='')),
+                  None)
+    HEAD = {
+        'sha': data['sha'],
+        'commit': {'sha': data['sha']},
+        'tree': {'sha': data['commit']['tree']['sha']},
+    }
+
+    try:
+        data = yield ("/repos/%s/contents/%s?ref=%s" %
+                      (GITHUB_REPO, quote(GITHUB_FILE),
+                       HEAD['sha']), None)
+    except NotFound as e:
+        raise RuntimeError("Repository %s doesn't contain a file named '%s'!" %
+                           (GITHUB_REPO, GITHUB_FILE)) from e
+
+    return HEAD, base64.b64decode(data['content'])
+
+
+def _read_travis_steps(snapshots, snapshot_key, fast_read):
+    """
+        Read GITHUB_FILE from @snapshots or, if it isn't there, from
+        GitHub and store a new snapshot.
+
+        @return - tuple (HEAD, travis, text) where travis is the parsed
+                  YAML and text the file contents
+    """
+    snapshot = snapshots.get(snapshot_key) if snapshots is not None else None
+    if snapshot is not None:
+        HEAD = {
+            'commit': {'sha': snapshot['commit']},
+            'tree': {'sha': snapshot['tree']},
+        }
+        return HEAD, snapshot['travis'], snapshot['text']
+
+    if fast_read:
+        HEAD, data = yield from _read_github_file_fast_steps(*snapshot_key)
+    else:
+        HEAD, data = yield from _read_github_file_steps(*snapshot_key)
+
+    text = data.decode('UTF-8')
+    travis = load_yaml(text.rstrip())
+    if snapshots is not None:
+        snapshots.set(snapshot_key, HEAD['commit']['sha'],
+                      HEAD['tree']['sha'], travis, text)
+    return HEAD, travis, text
+
+
+def _create_steps(created, kind, journal_entry, url, post_data):
+    """
+        POST @post_data to @url unless an object of @kind was created
+        by an earlier attempt, see WriteJournal.
+
+        @journal_entry - tuple (journal, key, parent, digest)
+        @return - the sha of the object
+    """
+    if kind not in created:
+        data = yield (url, post_data)
+        created[kind] = data['sha']
+        journal, key, parent, digest = journal_entry
+        if journal is not None:
+            journal.record(key, parent, digest, kind, data['sha'])
+    return created[kind]
+
+
+def _push_steps(snapshot_key, HEAD, message, content, journal):
+    """
+        Create a commit which replaces GITHUB_FILE with @content on top
+        of HEAD and point GITHUB_BRANCH to it. Objects recorded in
+        @journal are reused.
+
+        @return - tuple (response, commit sha, tree sha) where response
+                  is the one of the ref update
+    """
+    import hashlib
+    GITHUB_REPO, _, GITHUB_FILE = snapshot_key
+    parent = HEAD['commit']['sha']
+    journal_entry = (journal, snapshot_key, parent, hashlib.sha1(
+        (message + '\0' + content).encode('UTF-8')).hexdigest())
+    created = {}
+    if journal is not None:
+        created = journal.get(*journal_entry[1:])
+
+    # step 3: Post your new file to the server
+    blob = yield from _create_steps(
+        created, 'blob', journal_entry,
+        "/repos/%s/git/blobs" % GITHUB_REPO,
+        {
+            'content': content,
+            'encoding': 'utf-8'
+        }
+    )
+
+    # step 5: Create a tree containing your new file
+    tree = yield from _create_steps(
+        created, 'tree', journal_entry,
+        "/repos/%s/git/trees" % GITHUB_REPO,
+        {
+            "base_tree": HEAD['tree']['sha'],
+            "tree": [{
+                "path": GITHUB_FILE,
+                "mode": "100644",
+                "type": "blob",
+                "sha": blob
+            }]
+        }
+    )
+
+    # step 6: Create a new commit
+    commit = yield from _create_steps(
+        created, 'commit', journal_entry,
+        "/repos/%s/git/commits" % GITHUB_REPO,
+        {
+            "message": message,
+            "parents": [parent],
+            "tree": tree
+        }
+    )
+
+    # step 7: Update HEAD, but don't force it!
+    data = yield (
+        "/repos/%s/git/refs/heads/%s" % snapshot_key[:2],
+        {
+            "sha": commit
+        }
+    )
+
+    # the branch either points to our commit or moved on, in both cases
+    # the objects created above can't be reused
+    if journal is not None:
+        journal.remove(snapshot_key)
+    return data, commit, tree
+
+
+def _apply_updates(travis, updates, kwargs):
+    for name, version in updates:
+        travis = update_travis(travis, name, version,
+                               kwargs.get('incremental', False),
+                               kwargs.get('strength'),
+                               kwargs.get('retention'))
+    return travis
+
+
+def _update_github_steps(**kwargs):
+    """
+        Generator behind update_github() and update_github_async()
+    """
+    if "GITHUB_TOKEN" not in os.environ:
+        raise RuntimeError("Set the GITHUB_TOKEN variable")
+
+    GITHUB_REPO = kwargs.get('GITHUB_REPO')
+    GITHUB_BRANCH = kwargs.get('GITHUB_BRANCH')
+    GITHUB_FILE = kwargs.get('GITHUB_FILE')
+
+    snapshots = kwargs.get('snapshots', _snapshots)
+    snapshot_key = (GITHUB_REPO, GITHUB_BRANCH, GITHUB_FILE)
+    HEAD, old_travis, old_text = yield from _read_travis_steps(
+        snapshots, snapshot_key, kwargs.get('fast_read'))
+
+    updates = kwargs.get('updates') or [(kwargs.get('name'),
+                                         kwargs.get('version'))]
+
+    parsed_travis = _apply_updates(old_travis, updates, kwargs)
+
+    # bail out if nothing changed
+    if parsed_travis == old_travis:
+        print("new == old, bailing out", kwargs)
+        return True
+
+    new_travis = None
+    if kwargs.get('patch'):
+        new_travis = patch_travis_env(old_text, old_travis, parsed_travis)
+    if new_travis is None:
+        new_travis = dump_yaml(parsed_travis, default_flow_style=False)
+
+    # ------------------------------------
+    # !!! WARNING WRITE OPERATIONS BELOW
+    # ------------------------------------
+
+    data, commit, tree = yield from _push_steps(
+        snapshot_key, HEAD, _commit_message(updates, GITHUB_FILE),
+        new_travis, kwargs.get('journal', _journal))
+
+    if snapshots is not None:
+        # PASS: HEAD moved so snapshots of other files on this branch are
+        # no longer valid. FAIL: somebody else pushed to the branch, read
+        # it again next time
+        snapshots.invalidate(GITHUB_REPO, GITHUB_BRANCH)
+    if 'object' in data:  # PASS
+        if snapshots is not None:
+            snapshots.set(snapshot_key, commit, tree, parsed_travis,
+                          new_travis)
+        return True
+
+    # FAIL
+    return data['message']
+
+
+def _is_idempotent(url, post_data):
+    """
+        GET requests, blobs and trees, which are addressed by their
+        contents, and updating a ref to a given sha can be repeated
+        safely. Creating a commit can't because each one gets a new sha.
+    """
+    return post_data is None or url.endswith(('/git/blobs', '/git/trees')) \
+        or '/git/refs/' in url
+
+
+def _retry_delay(attempt):
+    """
+        Exponential backoff with full jitter.
+    """
+    import random
+    return random.uniform(0, min(RETRY_MAX_DELAY,
+                                 RETRY_BACKOFF * 2 ** attempt))
+
+
+def _retrying_steps(steps, transient_errors):
+    """
+        Wrap a *_steps generator so that idempotent requests which fail
+        with one of @transient_errors are retried with exponential
+        backoff. Other errors are thrown back into @steps so it can
+        handle them.
+
+        Yields (url, post_data, delay) tuples: wait for delay seconds,
+        make the request and send back a (response, error) tuple.
+
+        @return - whatever @steps returns
+    """
+    response, error = None, None
+    while True:
+        try:
+            if error is None:
+                url, post_data = steps.send(response)
+            else:
+                url, post_data = steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+
+        delay = 0
+        for attempt in range(RETRY_ATTEMPTS + 1):
+            response, error = yield url, post_data, delay
+            if not isinstance(error, transient_errors) or \
+                    attempt == RETRY_ATTEMPTS or \
+                    not _is_idempotent(url, post_data):
+                break
+            print("%s, retrying ..." % error)
+            delay = _retry_delay(attempt)
+
+
+def _fetch(url, post_data, compress):
+    try:
+        if post_data is None:
+            return net.lookup('get_url')(url), None
+        return net.lookup('post_url')(url, post_data,
+                                      compress=compress), None
+    except Exception as e:  # pylint: disable=broad-except
+        return None, e
+
+
+def _run_steps(steps, compress=False):
+    """
+        Drive a *_steps generator with blocking get_url() and post_url()
+        calls, see _retrying_steps(). POST bodies are compressed if
+        @compress is True.
+
+        @return - whatever the generator returns
+    """
+    import http.client
+    steps = _retrying_steps(
+        steps, (ServerError, OSError, http.client.HTTPException))
+
+    outcome = None
+    while True:
+        try:
+            url, post_data, delay = steps.send(outcome)
+        except StopIteration as stop:
+            return stop.value
+        if delay:
+            time.sleep(delay)
+        outcome = _fetch(url, post_data, compress)
+
+
+def update_github(**kwargs):
+    """
+        Update GitHub via API
+
+        Besides GITHUB_REPO, GITHUB_BRANCH and GITHUB_FILE this accepts
+        either 'name' and 'version' of a single new package release or
+        'updates', a list of (name, version) tuples which are all
+        applied and pushed as a single commit.
+
+        If 'fast_read' is True the current file is read with two requests
+        via the commits and contents API instead of walking the tree.
+
+        If 'incremental' is True only the new rows are added to the
+        matrix, see update_travis_incremental(). 'strength' builds a
+        t-way covering array instead of the full matrix, e.g. 2 for
+        all-pairs testing, see calculate_new_travis_env(). 'retention'
+        limits the versions kept for each package, see retained_versions().
+
+        If 'patch' is True only the lines of the env section which changed
+        are modified, see patch_travis_env(). Otherwise the whole file is
+        re-serialized.
+
+        'snapshots' may be a RepositorySnapshots instance to read the
+        file from. By default the one from the current monitor_pypi_rss()
+        run is used, if any.
+
+        'journal' is the WriteJournal used to resume a failed update,
+        see configure_write_journal(). Pass None to disable it.
+
+        If 'compress' is True large request bodies, e.g. the new blob,
+        are sent gzip encoded. Only use this with servers which accept
+        compressed requests.
+    """
+    return _run_steps(_update_github_steps(**kwargs),
+                      kwargs.get('compress', False))
@@ -0,0 +1,644 @@
+# pylint: disable=missing-docstring,invalid-name
+"""
+    The HTTP layer: keep-alive connection pool, per host rate limiting,
+    the conditional request cache and get_url()/post_url().
+"""
+import os
+import sys
+import json
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from io import BytesIO
+
+from strazar.files import write_atomic
+from strazar.stats import record_request
+
+# the orjson module, False if it isn't installed. Set the first time a
+# JSON response is parsed because importing it slows down `import strazar`
+orjson = None
+
+
+def _import_orjson():
+    global orjson  # pylint: disable=global-statement
+    if orjson is None:
+        try:
+            import orjson as module
+        except ImportError:
+            module = False
+        orjson = module
+    return orjson
+
+
+class NotFound(Exception):
+    """
+        Raised by get_url() when the server responds with 404.
+    """
+
+
+class ServerError(Exception):
+    """
+        Raised by get_url() when the server responds with 5xx.
+    """
+
+
+# size of the blocks read from the socket
+CHUNK_SIZE = 64 * 1024
+
+# request bodies smaller than this are never compressed
+COMPRESS_MIN_SIZE = 1024
+
+
+class ContentDecoder(object):
+    """
+        Incrementally decodes a response body sent with the gzip or
+        deflate Content-Encoding. Other encodings are passed through.
+        @received counts the bytes as they came over the wire.
+    """
+    def __init__(self, encoding):
+        self.encoding = (encoding or '').strip().lower()
+        self.received = 0
+        if self.encoding in ('gzip', 'x-gzip'):
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == 'deflate':
+            self._zlib = zlib.decompressobj()
+        else:
+            self._zlib = None
+
+    def decode(self, chunk):
+        self.received += len(chunk)
+        if self._zlib is None:
+            return chunk
+        try:
+            return self._zlib.decompress(chunk)
+        except zlib.error:
+            if self.encoding != 'deflate' or self.received != len(chunk):
+                raise
+            # some servers send raw deflate data without the zlib header
+            self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._zlib.decompress(chunk)
+
+    def flush(self):
+        if self._zlib is None:
+            return b''
+        return self._zlib.flush()
+
+
+class ConnectionPool(object):
+    """
+        Thread-safe pool of keep-alive HTTP(S) connections, one list
+        of idle connections per (scheme, host) pair.
+
+        @max_idle - int - how many idle connections to keep per host
+        @connect_timeout - float - seconds to wait for the TCP/TLS connect
+        @read_timeout - float - seconds to wait for data on the socket
+    """
+    def __init__(self, max_idle=4, connect_timeout=10, read_timeout=30):
+        self.max_idle = max_idle
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, scheme, host_port):
+        import http.client
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host_port,
+                                               timeout=self.connect_timeout)
+        else:
+            conn = http.client.HTTPConnection(host_port,
+                                              timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def acquire(self, scheme, host_port):
+        """
+            Returns a tuple (connection, reused) where reused is True
+            if the connection was taken from the idle list.
+        """
+        with self._lock:
+            idle = self._idle.get((scheme, host_port))
+            if idle:
+                return idle.pop(), True
+        return self._connect(scheme, host_port), False
+
+    def release(self, scheme, host_port, conn):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host_port), [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def request(self, scheme, host_port, method, path, body, headers):
+        """
+            Execute a request and return (status, response headers, body,
+            bytes received). Compressed bodies are decoded while they are
+            read. If a reused connection was closed by the server in the
+            mean time, i.e. before a status line arrived, we reconnect and
+            send the request again.
+        """
+        # pylint: disable=too-many-arguments
+        import http.client
+        while True:
+            conn, reused = self.acquire(scheme, host_port)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                # the server closed an idle connection before it got the
+                # request. Timeouts are not retried because the request may
+                # have been processed already
+                conn.close()
+                if not reused:
+                    raise
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                raise
+
+        # the server answered so it has seen the request, errors while
+        # reading the body are never retried
+        try:
+            decoder = ContentDecoder(response.getheader('Content-Encoding'))
+            chunks = []
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunks.append(decoder.decode(chunk))
+            chunks.append(decoder.flush())
+        except (http.client.HTTPException, OSError, zlib.error):
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self.release(scheme, host_port, conn)
+        return (response.status, response.getheaders(), b''.join(chunks),
+                decoder.received)
+
+
+_pool = ConnectionPool()
+
+
+def configure_connection_pool(max_idle=4, connect_timeout=10,
+                              read_timeout=30):
+    """
+        Replace the connection pool used by get_url(), see ConnectionPool.
+        Idle connections of the previous pool are closed.
+    """
+    global _pool  # pylint: disable=global-statement
+    previous, _pool = _pool, ConnectionPool(max_idle, connect_timeout,
+                                            read_timeout)
+    previous.clear()
+    return _pool
+
+
+def close_connections():
+    """
+        Close the idle keep-alive connections of the connection pool.
+    """
+    _pool.clear()
+
+
+class RateLimiter(object):
+    """
+        Token bucket which paces requests per host according to the
+        X-RateLimit-Remaining, X-RateLimit-Reset and Retry-After headers
+        sent by GitHub.
+
+        The bucket holds at most @burst tokens and is refilled so that
+        the remaining quota is spread over the time left until the
+        reset. When the quota is exhausted, or the server asks us to
+        back off, requests wait for the reset instead of failing.
+
+        @burst - int - how many requests may be sent back to back
+        @max_retries - int - how often a rate limited request is retried
+        @clock - callable - returns the current time as a UNIX timestamp
+    """
+    def __init__(self, burst=100, max_retries=3, clock=time.time):
+        self.burst = burst
+        self.max_retries = max_retries
+        self.clock = clock
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def delay(self, host):
+        """
+            Reserve a token for the next request to @host and return how
+            many seconds the caller has to wait before sending it.
+        """
+        now = self.clock()
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                return 0
+
+            if state['blocked_until'] > now:
+                return state['blocked_until'] - now
+
+            window = state['reset'] - now
+            if state['remaining'] is None or window <= 0:
+                # no quota known or the window has been reset already
+                return 0
+
+            if state['remaining'] <= 0:
+                state['blocked_until'] = state['reset']
+                return window
+
+            rate = float(state['remaining']) / window
+            tokens = min(self.burst,
+                         state['tokens'] + (now - state['updated']) * rate)
+            state['updated'] = now
+            state['tokens'] = tokens - 1
+            state['remaining'] -= 1
+            if tokens >= 1:
+                return 0
+            return (1 - tokens) / rate
+
+    def update(self, host, status, response_headers):
+        """
+            Record the quota reported by the response headers.
+            Returns True if the request was rejected because of the
+            rate limit and should be retried.
+        """
+        response_headers = dict((k.lower(), v) for k, v in response_headers)
+        now = self.clock()
+
+        retry_after = response_headers.get('retry-after')
+        if retry_after is not None:
+            try:
+                retry_after = now + float(retry_after)
+            except ValueError:
+                from email.utils import mktime_tz, parsedate_tz
+                parsed = parsedate_tz(retry_after)
+                retry_after = mktime_tz(parsed) if parsed else None
+
+        with self._lock:
+            state = self._hosts.setdefault(host, {
+                'remaining': None,
+                'reset': 0,
+                'tokens': self.burst,
+                'updated': now,
+                'blocked_until': 0,
+            })
+
+            if 'x-ratelimit-remaining' in response_headers:
+                try:
+                    state['remaining'] = int(
+                        response_headers['x-ratelimit-remaining'])
+                    state['reset'] = float(
+                        response_headers.get('x-ratelimit-reset', 0))
+                except ValueError:
+                    pass
+
+            limited = status in (403, 429) and (
+                retry_after is not None or state['remaining'] == 0)
+            if retry_after is not None:
+                state['blocked_until'] = max(state['blocked_until'],
+                                             retry_after)
+            elif limited:
+                state['blocked_until'] = state['reset']
+            return limited
+
+    def clear(self):
+        with self._lock:
+            self._hosts = {}
+
+
+_limiter = RateLimiter()
+
+
+# temporary files older than this many seconds were left over by an
+# interrupted HTTPCache.set(), younger ones may still be written to
+CACHE_TMP_MAX_AGE = 3600
+
+
+class HTTPCache(object):
+    """
+        On-disk cache of GET responses keyed by URL. Each entry remembers
+        the ETag and Last-Modified headers so that the next request for
+        the same URL can be made conditional. When more than @max_entries
+        are stored the least recently used ones are evicted.
+
+        Every entry is a single file: a line of JSON meta-data followed
+        by the raw response body.
+    """
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        entries = []
+        now = time.time()
+        for name in os.listdir(path):
+            filename = os.path.join(path, name)
+            try:
+                mtime = os.path.getmtime(filename)
+                if not name.startswith('.'):
+                    entries.append((mtime, name))
+                elif now - mtime > CACHE_TMP_MAX_AGE:
+                    # left over by an interrupted set(), another process
+                    # sharing the directory may be writing younger ones
+                    os.remove(filename)
+            except OSError:
+                # renamed or evicted by another process in the mean time
+                continue
+        for _, name in sorted(entries):
+            self._lru[name] = True
+
+    @staticmethod
+    def _key(url):
+        import hashlib
+        return hashlib.sha1(url.encode('UTF-8')).hexdigest()
+
+    def get(self, url):
+        """
+            Returns a tuple (meta, body) or None if url is not cached.
+        """
+        key = self._key(url)
+        with self._lock:
+            if key not in self._lru:
+                return None
+            self._lru.pop(key)
+            self._lru[key] = True
+
+        filename = os.path.join(self.path, key)
+        try:
+            with open(filename, 'rb') as cache_file:
+                meta = json.loads(cache_file.readline().decode('UTF-8'))
+                body = cache_file.read()
+            os.utime(filename, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return meta, body
+
+    def set(self, url, meta, body):
+        key = self._key(url)
+        # readers and concurrent writers never see a partially written entry
+        write_atomic(os.path.join(self.path, key),
+                     json.dumps(meta).encode('UTF-8') + b'\n' + body)
+
+        evicted = []
+        with self._lock:
+            self._lru.pop(key, None)
+            self._lru[key] = True
+            while len(self._lru) > self.max_entries:
+                evicted.append(self._lru.popitem(last=False)[0])
+
+        for name in evicted:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+
+
+_cache = None
+
+
+def configure_http_cache(path, max_entries=1000):
+    """
+        Enable the conditional GET cache stored under @path.
+        Pass path=None to disable it.
+    """
+    global _cache  # pylint: disable=global-statement
+    if path is None:
+        _cache = None
+    else:
+        _cache = HTTPCache(path, max_entries)
+    return _cache
+
+
+def _prepare_request(url, post_data=None, compress=False, raw=False,
+                     stream=False):
+    """
+        Build everything needed to send a request to @url. The result
+        is a dict shared by the blocking and the asyncio transports.
+
+        If @compress is True large request bodies are sent gzip encoded.
+        @raw and @stream select the response format, see get_url().
+    """
+    # GitHub requires a valid UA string
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:10.0.5) \
+Gecko/20120601 Firefox/10.0.5',
+        'Accept-Encoding': 'gzip, deflate',
+    }
+
+    # shortcut for GitHub API calls
+    if url.find("://") == -1:
+        url = "https://api.github.com%s" % url
+
+    if url.find('api.github.com') > -1:
+        if "GITHUB_TOKEN" not in os.environ:
+            raise Exception("Set the GITHUB_TOKEN variable")
+        else:
+            headers.update({
+                'Authorization': 'token %s' % os.environ['GITHUB_TOKEN']
+            })
+
+    (scheme, host_path) = url.split('://')
+    (host_port, path) = host_path.split('/', 1)
+    path = '/' + path
+
+    method = 'GET'
+    if post_data:
+        method = 'POST'
+        post_data = json.dumps(post_data).encode('UTF-8')
+        headers['Content-Type'] = 'application/json'
+        if compress and len(post_data) >= COMPRESS_MIN_SIZE:
+            import gzip
+            post_data = gzip.compress(post_data)
+            headers['Content-Encoding'] = 'gzip'
+
+    cached = None
+    if method == 'GET' and _cache is not None:
+        cached = _cache.get(url)
+        if cached:
+            if cached[0].get('etag'):
+                headers['If-None-Match'] = cached[0]['etag']
+            if cached[0].get('last_modified'):
+                headers['If-Modified-Since'] = cached[0]['last_modified']
+
+    return {
+        'url': url,
+        'scheme': scheme,
+        'host_port': host_port,
+        'method': method,
+        'path': path,
+        'body': post_data,
+        'headers': headers,
+        'cached': cached,
+        'body_format': 'stream' if stream else 'bytes' if raw else 'decoded',
+    }
+
+
+def _json_loads(data):
+    """
+        Parse JSON from bytes, with orjson if it is installed.
+    """
+    parser = _import_orjson()
+    try:
+        if parser:
+            return parser.loads(data)
+        return json.loads(data.decode('UTF-8'))
+    except ValueError:
+        # invalid UTF-8, the stdlib parser is more forgiving
+        return json.loads(data.decode('UTF-8', 'replace'))
+
+
+def _parse_content_type(value):
+    """
+        Returns a tuple (media type, charset) from a Content-Type header.
+    """
+    if not value:
+        return None, 'UTF-8'
+    params = value.split(';')
+    charset = 'UTF-8'
+    for param in params[1:]:
+        name, _, param_value = param.partition('=')
+        if name.strip().lower() == 'charset' and param_value.strip():
+            charset = param_value.strip().strip('"')
+    return params[0].strip().lower(), charset
+
+
+def _decode_body(body, content_type):
+    """
+        Decode @body according to @content_type: JSON media types are
+        parsed, everything else is returned as text. Without a
+        Content-Type JSON is tried first.
+    """
+    media_type, charset = _parse_content_type(content_type)
+    if media_type is None or media_type == 'application/json' or \
+            media_type.endswith('+json'):
+        try:
+            return _json_loads(body)
+        except ValueError:
+            # not a JSON response
+            pass
+    try:
+        return body.decode(charset, 'replace')
+    except LookupError:
+        return body.decode('UTF-8', 'replace')
+
+
+def _finish_request(request, status, response_headers, result):
+    """
+        Turn the raw response to @request into the value returned
+        by get_url(), updating the HTTP cache along the way.
+    """
+    url = request['url']
+    cached = request['cached']
+
+    if status == 404:
+        raise NotFound("404 - %s not found" % url)
+
+    if status >= 500:
+        raise ServerError("%d - %s failed" % (status, url))
+
+    response_headers = dict((k.lower(), v) for k, v in response_headers)
+    content_type = response_headers.get('content-type')
+    if status == 304 and cached:
+        # not modified, GitHub doesn't count this against the rate limit
+        result = cached[1]
+        content_type = cached[0].get('content_type')
+    elif request['method'] == 'GET' and _cache is not None and status == 200:
+        meta = {
+            'etag': response_headers.get('etag'),
+            'last_modified': response_headers.get('last-modified'),
+            'content_type': content_type,
+        }
+        if meta['etag'] or meta['last_modified']:
+            try:
+                _cache.set(url, meta, result)
+            except (IOError, OSError) as e:
+                # the response is fine, it just won't be cached
+                print("cannot cache %s: %s" % (url, e))
+
+    if request['body_format'] == 'bytes':
+        return result
+    if request['body_format'] == 'stream':
+        return BytesIO(result)
+    return _decode_body(result, content_type)
+
+
+# todo: this goes away once we port to
+# the Github module and don't use the API directly
+def get_url(url, post_data=None, compress=False, raw=False, stream=False):
+    """
+        Send a GET, or a POST if @post_data is given, request to @url.
+
+        By default JSON responses are parsed and other responses are
+        returned as text, according to their Content-Type. With
+        @raw=True the body is returned as bytes and with @stream=True as
+        a binary file-like object, without decoding it.
+    """
+    request = _prepare_request(url, post_data, compress, raw, stream)
+    host = request['host_port']
+    for attempt in range(_limiter.max_retries + 1):
+        wait = _limiter.delay(host)
+        if wait > 0:
+            time.sleep(wait)
+
+        started = time.time()
+        status, response_headers, result, received = _pool.request(
+            request['scheme'], host, request['method'],
+            request['path'], request['body'], request['headers'])
+        record_request(request, started, received)
+        limited = _limiter.update(host, status, response_headers)
+        if not limited or attempt == _limiter.max_retries:
+            break
+        print("rate limited by %s, deferring request to %s" % (host, url))
+    return _finish_request(request, status, response_headers, result)
+
+
+def post_url(url, data, compress=False):
+    return lookup('get_url')(url, data, compress=compress)
+
+
+def lookup(name):
+    """
+        Returns strazar.<name>. get_url() and post_url() are called
+        through this so that patching strazar.get_url or strazar.post_url
+        intercepts every request, not only direct calls.
+    """
+    return getattr(sys.modules['strazar'], name)
+
+
+def xmlrpc_server(url, timeout=None):
+    """
+        Returns a ServerProxy for @url whose connections give up after
+        @timeout seconds instead of waiting for a stalled server forever.
+        Defaults to the read timeout of the connection pool.
+    """
+    if timeout is None:
+        timeout = _pool.read_timeout
+    import xmlrpc.client
+    if url.startswith('https:'):
+        base = xmlrpc.client.SafeTransport
+    else:
+        base = xmlrpc.client.Transport
+
+    class _Transport(base):
+        def make_connection(self, host):
+            conn = base.make_connection(self, host)
+            conn.timeout = timeout
+            return conn
+
+    return xmlrpc.client.ServerProxy(url, transport=_Transport())
@@ -0,0 +1,498 @@
+# pylint: disable=missing-docstring,invalid-name
+"""
+    Watching PyPI for new releases and executing the configured callbacks.
+"""
+import os
+import re
+import json
+import fnmatch
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from strazar import net
+from strazar.files import write_atomic
+from strazar.github import repository_snapshots
+from strazar.stats import metrics, record_callback
+
+
+PYPI_RSS_URL = "https://pypi.python.org/pypi?:action=rss"
+RSS_DATE_FORMAT = '%d %b %Y %H:%M:%S GMT'
+
+
+def parse_pypi_rss(feed, since=None):
+    """
+        Incrementally parse a PyPI RSS feed and yield a
+        (name, version, released_on) tuple for every item as soon as
+        it has been read. Items are discarded right after that so
+        memory usage doesn't grow with the size of the feed.
+
+        @feed - file-like object opened in binary mode, or a file name
+        @since - optional (released_on, title) tuple of the newest item
+                 seen previously. The feed lists newest items first so
+                 parsing stops once this item, or an older one, is found.
+
+        Items which fail to parse are logged and skipped.
+    """
+    from xml.etree.ElementTree import iterparse
+
+    channel = None
+    for event, elem in iterparse(feed, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'channel':
+                channel = elem
+            continue
+
+        if elem.tag != 'item':
+            continue
+
+        title = elem.findtext('title')
+        try:
+            (name, version) = title.split(" ")
+            released_on = datetime.strptime(elem.findtext('pubDate'),
+                                            RSS_DATE_FORMAT)
+        except Exception as e:  # pylint: disable=broad-except
+            print("ERROR when processing %s" % title)
+            print(e)
+            continue
+        finally:
+            # drop already processed items
+            if channel is not None:
+                channel.clear()
+            else:
+                elem.clear()
+
+        if since and (title == since[1] or released_on < since[0]):
+            return
+
+        yield name, version, released_on
+
+
+def _load_cursor(state_file):
+    """
+        Returns the (released_on, title) tuple stored in @state_file
+        or None if there is no previous state.
+    """
+    if not state_file or not os.path.exists(state_file):
+        return None
+
+    with open(state_file) as cursor_file:
+        state = json.load(cursor_file)
+    return (datetime.strptime(state['pub_date'], RSS_DATE_FORMAT),
+            state['title'])
+
+
+def _save_cursor(state_file, cursor):
+    # atomic, so an interrupted run never leaves a broken state file
+    write_atomic(state_file, json.dumps({
+        'pub_date': cursor[0].strftime(RSS_DATE_FORMAT),
+        'title': cursor[1],
+    }))
+
+
+PYPI_XMLRPC_URL = "https://pypi.org/pypi"
+
+
+def _changelog_releases(since_serial, url, timeout):
+    """
+        Same as pypi_changelog() but every release is a (name, version,
+        released_on, serial) tuple.
+    """
+    server = net.xmlrpc_server(url, timeout)
+    if since_serial is None:
+        return [], server.changelog_last_serial()
+
+    releases = []
+    serial = since_serial
+    for name, version, timestamp, action, event_serial in \
+            server.changelog_since_serial(since_serial):
+        serial = max(serial, event_serial)
+        if action != 'new release' or not version:
+            continue
+        releases.append((name, version, datetime.utcfromtimestamp(timestamp),
+                         event_serial))
+    return releases, serial
+
+
+def pypi_changelog(since_serial, url=PYPI_XMLRPC_URL, timeout=None):
+    """
+        Read the events PyPI logged after @since_serial via the XML-RPC
+        changelog_since_serial() API. Unlike the RSS feed the changelog
+        is complete and only new events are transferred.
+
+        @since_serial - int - serial of the last event seen previously.
+                If None nothing is read, only the current serial is
+                returned so that the next call starts from there.
+        @timeout - float - seconds to wait for PyPI, the read timeout of
+                the connection pool by default
+        @return - tuple (releases, serial) where releases is a list of
+                (name, version, released_on) tuples, oldest first, and
+                serial is the serial of the last event read
+    """
+    releases, serial = _changelog_releases(since_serial, url, timeout)
+    return [release[:3] for release in releases], serial
+
+
+def _changelog_serial(releases, serial, failed):
+    """
+        Returns the serial to save after a monitor_pypi_changelog() run,
+        @serial unless a callback failed for one of @releases. Then it is
+        the serial just before the oldest failed release so that it is
+        read again on the next run.
+    """
+    for name, version, _, event_serial in releases:
+        if (name, version) in failed:
+            return event_serial - 1
+    return serial
+
+
+def _load_serial(state_file):
+    """
+        Returns the changelog serial stored in @state_file or None if
+        there is no previous state.
+    """
+    if not state_file or not os.path.exists(state_file):
+        return None
+
+    with open(state_file) as serial_file:
+        return json.load(serial_file)['serial']
+
+
+def _save_serial(state_file, serial):
+    write_atomic(state_file, json.dumps({'serial': serial}))
+
+
+def canonical_name(name):
+    """
+        Normalize a package name according to PEP 503.
+    """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+class PackageMatcher(object):
+    """
+        Compiled form of the monitor configuration. Package names are
+        indexed by their PEP 503 canonical form so that ``PyYAML``,
+        ``pyyaml`` and ``py_yaml`` all share the same callbacks. Keys
+        which contain glob characters, e.g. ``django-*``, are matched
+        against the canonical name of every package.
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, config):
+        self._exact = {}
+        self._patterns = []
+
+        patterns = {}
+        for key, callbacks in config.items():
+            name = canonical_name(key)
+            if set('*?[') & set(name):
+                target = patterns.setdefault(name, [])
+            else:
+                target = self._exact.setdefault(name, [])
+
+            for cfg in callbacks:
+                if cfg not in target:
+                    target.append(cfg)
+
+        for pattern, callbacks in patterns.items():
+            self._patterns.append(
+                (re.compile(fnmatch.translate(pattern)), callbacks))
+
+    def match(self, name):
+        """
+            Returns the list of callback configs for package @name.
+        """
+        name = canonical_name(name)
+        result = self._exact.get(name, [])
+
+        for regex, callbacks in self._patterns:
+            if regex.match(name):
+                result = result + [cfg for cfg in callbacks
+                                   if cfg not in result]
+        return result
+
+
+def _target(args):
+    return args.get('GITHUB_REPO'), args.get('GITHUB_BRANCH')
+
+
+class _TargetLocks(object):
+    """
+        One lock per GITHUB_REPO/GITHUB_BRANCH target so that callbacks
+        which update the same ref don't race each other.
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self):
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, args):
+        with self._lock:
+            return self._locks.setdefault(_target(args), threading.Lock())
+
+
+def _new_result(cfg, extra_args):
+    """
+        Returns the result dict of a callback which hasn't been executed
+        yet, see monitor_pypi_rss().
+    """
+    args = dict(cfg['args'])
+    args.update(extra_args)
+    return {
+        'cb': cfg['cb'],
+        'args': args,
+        'result': None,
+        'error': None,
+    }
+
+
+def _execute_callback(cfg, extra_args, locks=None):
+    """
+        Execute a single callback and return a dict describing the
+        outcome. Exceptions are caught and recorded in the result.
+    """
+    result = _new_result(cfg, extra_args)
+    args = result['args']
+
+    started = time.time()
+    try:
+        if locks is None:
+            result['result'] = cfg['cb'](**args)
+        else:
+            with locks.get(args):
+                result['result'] = cfg['cb'](**args)
+    except Exception as e:  # pylint: disable=broad-except
+        print(e)
+        result['error'] = e
+    record_callback(result, started)
+    return result
+
+
+def _add_to_batch(batches, cfg, extra_args, newest_first=True):
+    """
+        Group pending updates by callback and arguments, i.e. by target
+        file and options such as patch or retention. Configurations which
+        pass different options for the same file end up in separate
+        batches. The RSS feed lists newest releases first so its updates
+        are prepended to keep them in chronological order.
+    """
+    key = (cfg['cb'], tuple(sorted([(name, repr(value))
+                                    for name, value in cfg['args'].items()])))
+    if key not in batches:
+        batches[key] = (cfg, {'updates': []})
+    update = (extra_args['name'], extra_args['version'])
+    if newest_first:
+        batches[key][1]['updates'].insert(0, update)
+    else:
+        batches[key][1]['updates'].append(update)
+
+
+def _rss_releases(feed, since, newest):
+    """
+        Releases from the RSS @feed, newest first.
+
+        @newest - list which receives the (released_on, title) tuple of
+                  the newest item in the feed
+    """
+    for name, version, released_on in parse_pypi_rss(feed, since):
+        if not newest:
+            newest.append((released_on, "%s %s" % (name, version)))
+        yield name, version, released_on
+
+
+def _rss_cursor(newest, matched, failed):
+    """
+        Returns the (released_on, title) cursor to save after a run or
+        None if the previous cursor has to be kept. If releases in
+        @failed, see _finish_monitoring(), were published at the times
+        in @matched, see _pending_callbacks(), the cursor only stores
+        the oldest of these times and has no title. The next run then
+        reads the failed releases, and all newer ones, again.
+    """
+    failed_on = [matched[release] for release in failed if release in matched]
+    if failed_on:
+        return min(failed_on), ''
+    if newest:
+        return newest[0]
+    return None
+
+
+def _pending_callbacks(config, releases, batch, newest_first=True,
+                       matched=None):
+    """
+        Yield a (cfg, extra_args) tuple for every callback which has to
+        be executed for @releases, an iterable of (name, version,
+        released_on) tuples.
+
+        @matched - optional dict which receives the released_on of every
+                   release with callbacks, keyed by (name, version)
+    """
+    if not isinstance(config, PackageMatcher):
+        config = PackageMatcher(config)
+
+    batches = OrderedDict()
+    for name, version, released_on in releases:
+        metrics.inc('strazar_feed_items_scanned_total')
+        callbacks = config.match(name)
+        if not callbacks:
+            print("package %s not found in config. continuing ..." % name)
+            continue
+
+        metrics.inc('strazar_feed_items_matched_total')
+        print("package %s was found in config ..." % name)
+        if matched is not None:
+            matched[(name, version)] = released_on
+        for cfg in callbacks:
+            extra_args = {
+                'name': name,
+                'version': version,
+                'released_on': released_on,
+            }
+            if batch:
+                _add_to_batch(batches, cfg, extra_args, newest_first)
+            else:
+                yield cfg, extra_args
+
+    for cfg, extra_args in batches.values():
+        yield cfg, extra_args
+
+
+def _finish_monitoring(results):
+    """
+        Log a summary of @results and return the set of (name, version)
+        tuples of the releases for which a callback failed.
+    """
+    failed = set()
+    errors = 0
+    for result in results:
+        if result['error'] is None:
+            continue
+        errors += 1
+        args = result['args']
+        failed.update(args.get('updates') or [(args.get('name'),
+                                               args.get('version'))])
+    print("executed %d callbacks, %d failed" % (len(results), errors))
+    return failed
+
+
+def _finish_rss_monitoring(results, state_file, newest, matched):
+    """
+        Save the cursor after a monitor_pypi_rss() run. Failed releases
+        are not skipped on the next run so their callbacks are retried.
+    """
+    cursor = _rss_cursor(newest, matched, _finish_monitoring(results))
+    if state_file and cursor is not None:
+        _save_cursor(state_file, cursor)
+
+
+def _dispatch_callbacks(pending, workers):
+    """
+        Execute the (cfg, extra_args) tuples from @pending, in a thread
+        pool of @workers threads if greater than 0.
+
+        @return - list of results from _execute_callback()
+    """
+    executor = None
+    locks = None
+    if workers:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=workers)
+        locks = _TargetLocks()
+
+    results = []
+    with repository_snapshots():
+        try:
+            for cfg, extra_args in pending:
+                if executor is None:
+                    results.append(_execute_callback(cfg, extra_args))
+                else:
+                    results.append(executor.submit(_execute_callback, cfg,
+                                                   extra_args, locks))
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+                results = [future.result() for future in results]
+    return results
+
+
+def monitor_pypi_rss(config, feed=None, state_file=None, workers=0,
+                     batch=False):
+    """
+        Scan the PyPI RSS feeds to look for new packages.
+        If name is found in config then execute the specified callback.
+
+        @config is a dict with keys matching package names and values
+        are lists of dicts
+            {
+                'cb' : a_callback,
+                'args' : dict
+            }
+            package names are compared in their PEP 503 normalized form
+            and may contain glob patterns like 'django-*'. An already
+            compiled PackageMatcher is accepted as well.
+        @feed - optional file-like object or file name to read the
+                RSS from instead of fetching it from PyPI, e.g. a
+                feed archive which is being replayed
+        @state_file - optional path to a JSON file which records the
+                newest item processed. Items up to and including it are
+                skipped on the next run. The cursor never moves past a
+                release for which a callback failed so that it is retried
+                on the next run.
+        @workers - int - when greater than 0 callbacks are executed in a
+                thread pool of this size. Callbacks for the same
+                GITHUB_REPO/GITHUB_BRANCH are still executed one at a time.
+        @batch - bool - if True callbacks are not executed per release.
+                Instead all releases are grouped by callback and
+                GITHUB_REPO/GITHUB_BRANCH/GITHUB_FILE and every callback
+                is executed once with an 'updates' argument, a list of
+                (name, version) tuples. update_github() turns them into
+                a single commit.
+
+        @return - list of dicts with keys 'cb', 'args', 'result' and
+                'error', one for every executed callback
+    """
+    if feed is None:
+        print("fetching RSS info from PyPI")
+        feed = net.lookup('get_url')(PYPI_RSS_URL, stream=True)
+
+    newest, matched = [], {}
+    releases = _rss_releases(feed, _load_cursor(state_file), newest)
+    results = _dispatch_callbacks(
+        _pending_callbacks(config, releases, batch, matched=matched), workers)
+
+    _finish_rss_monitoring(results, state_file, newest, matched)
+    return results
+
+
+def monitor_pypi_changelog(config, state_file=None, serial=None, workers=0,
+                           batch=False, url=PYPI_XMLRPC_URL):
+    """
+        Same as monitor_pypi_rss() but reads the PyPI changelog instead
+        of the RSS feed, see pypi_changelog(). Every release published
+        since the previous run is seen, no matter how busy PyPI was.
+
+        @state_file - optional path to a JSON file which records the
+                serial of the last event processed. If a callback fails
+                the serial just before that release is recorded instead
+                so that it is retried on the next run.
+        @serial - optional serial to start from, overrides @state_file.
+                Without either only the current serial is recorded and
+                no callbacks are executed.
+        @url - the PyPI XML-RPC endpoint
+    """
+    # pylint: disable=too-many-arguments
+    if serial is None:
+        serial = _load_serial(state_file)
+
+    print("fetching changelog since serial %s from PyPI" % serial)
+    releases, serial = _changelog_releases(serial, url, None)
+    results = _dispatch_callbacks(
+        _pending_callbacks(config, [release[:3] for release in releases],
+                           batch, newest_first=False),
+        workers)
+
+    serial = _changelog_serial(releases, serial, _finish_monitoring(results))
+    if state_file:
+        _save_serial(state_file, serial)
+    return results
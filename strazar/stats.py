@@ -0,0 +1,145 @@
+# pylint: disable=missing-docstring,invalid-name
+"""
+    Run metrics: HTTP requests, callbacks, feed items and matrix sizes.
+"""
+import json
+import threading
+import time
+
+from strazar.files import write_atomic
+
+
+class Metrics(object):
+    """
+        Thread-safe registry of counters and histograms which describe a
+        run: HTTP requests, callbacks, feed items and matrix sizes.
+
+        Export with to_json(), to_prometheus() or write().
+    """
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    ROWS_BUCKETS = (1, 10, 100, 1000, 10000, 100000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = {
+                    'buckets': [[bound, 0] for bound in buckets],
+                    'sum': 0,
+                    'count': 0,
+                }
+            histogram = self._histograms[key]
+            for bucket in histogram['buckets']:
+                if value <= bucket[0]:
+                    bucket[1] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def to_json(self):
+        with self._lock:
+            return json.dumps({
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                'histograms': [
+                    dict(histogram, name=name, labels=dict(labels))
+                    for (name, labels), histogram in
+                    sorted(self._histograms.items())
+                ],
+            }, indent=4, sort_keys=True)
+
+    def to_prometheus(self):
+        """
+            Returns the metrics in the Prometheus text exposition format,
+            e.g. for the node_exporter textfile collector.
+        """
+        def _labels(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if not labels:
+                return ''
+            return '{%s}' % ','.join(
+                '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace(
+                    '"', '\\"')) for k, v in labels)
+
+        lines = []
+        seen = set()
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append('# TYPE %s counter' % name)
+                lines.append('%s%s %s' % (name, _labels(labels), value))
+
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append('# TYPE %s histogram' % name)
+                for bound, count in histogram['buckets']:
+                    lines.append('%s_bucket%s %d' % (
+                        name, _labels(labels, [('le', bound)]), count))
+                lines.append('%s_bucket%s %d' % (
+                    name, _labels(labels, [('le', '+Inf')]),
+                    histogram['count']))
+                lines.append('%s_sum%s %s' % (name, _labels(labels),
+                                              histogram['sum']))
+                lines.append('%s_count%s %d' % (name, _labels(labels),
+                                                histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+            Write the metrics to @path, as JSON if the file name ends
+            with .json and in the Prometheus text format otherwise. The
+            file is replaced atomically.
+        """
+        if path.endswith('.json'):
+            data = self.to_json()
+        else:
+            data = self.to_prometheus()
+
+        write_atomic(path, data)
+
+
+metrics = Metrics()
+
+
+def record_request(request, started, received):
+    host = request['host_port']
+    metrics.inc('strazar_http_requests_total', host=host,
+                method=request['method'])
+    metrics.observe('strazar_http_request_duration_seconds',
+                    time.time() - started, host=host)
+    metrics.inc('strazar_http_sent_bytes_total',
+                len(request['body'] or b''), host=host)
+    metrics.inc('strazar_http_received_bytes_total', received, host=host)
+
+
+def record_callback(result, started):
+    name = getattr(result['cb'], '__name__', repr(result['cb']))
+    metrics.observe('strazar_callback_duration_seconds',
+                    time.time() - started, callback=name)
+    if result['error'] is not None:
+        metrics.inc('strazar_callback_failures_total', callback=name)
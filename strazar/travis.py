@@ -0,0 +1,475 @@
+# pylint: disable=missing-docstring,invalid-name
+"""
+    Reading, updating and patching the env matrix of .travis.yml.
+"""
+import heapq
+from collections import OrderedDict
+from itertools import combinations, product
+
+from strazar.stats import Metrics, metrics
+
+# set to the libyaml based CSafeLoader and CSafeDumper, if PyYAML was built
+# with it, or to SafeLoader and SafeDumper the first time YAML is used
+YamlLoader = None
+YamlDumper = None
+
+
+def _import_yaml():
+    global YamlLoader, YamlDumper  # pylint: disable=global-statement
+    import yaml
+    if YamlLoader is None:
+        # use libyaml if PyYAML was built with it, it is much faster
+        YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+        YamlDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+    return yaml
+
+
+def load_yaml(stream):
+    """
+        Parse the YAML document in @stream, a string or a file object,
+        with the safe loader.
+    """
+    return _import_yaml().load(stream, Loader=YamlLoader)
+
+
+def dump_yaml(data, **kwargs):
+    """
+        Serialize @data with the safe dumper. @kwargs are passed to
+        yaml.dump(), e.g. default_flow_style.
+    """
+    return _import_yaml().dump(data, Dumper=YamlDumper, **kwargs)
+
+
+def travis_variable_name(package):
+    """
+        Returns the environment variable used for @package,
+        e.g. django-storages -> _DJANGO_STORAGES
+    """
+    return '_' + package.upper().replace('-', '_')
+
+
+def _parse_travis_env(env):
+    """
+        Collect the versions of every package listed in @env.
+
+        @return - tuple (groups, pkg_versions) where groups is an ordered
+                  dict of the package names which appear on the same line
+                  mapped to the index of the last such line and
+                  pkg_versions maps package names to sets of versions
+    """
+    groups = OrderedDict()
+    pkg_versions = {}
+
+    for index, line in enumerate(env):
+        packages_on_this_line = ()
+        for variable in line.split(' '):
+            p_name, p_version = variable.split('=')
+            packages_on_this_line += (p_name,)
+            if p_name in pkg_versions:
+                pkg_versions[p_name].add(p_version)
+            else:
+                pkg_versions[p_name] = set([p_version])
+        groups[packages_on_this_line] = index
+
+    return groups, pkg_versions
+
+
+def retained_versions(versions, policy):
+    """
+        Apply a retention @policy to a set of @versions ordered according
+        to PEP 440. @policy is a dict with the optional keys:
+
+            'latest_patch' - bool - keep only the latest patch release
+                of every major.minor series
+            'keep' - int - keep only this many of the newest versions
+
+        Versions which are not valid PEP 440 versions are always kept
+        because they can't be ordered.
+
+        @return - set of versions to keep
+    """
+    try:
+        from packaging.version import InvalidVersion, Version
+    except ImportError as e:
+        raise RuntimeError(
+            "Version retention requires the packaging module") from e
+
+    parsed = {}
+    kept = set()
+    for version in versions:
+        try:
+            parsed[version] = Version(version)
+        except InvalidVersion:
+            kept.add(version)
+
+    ordered = sorted(parsed, key=parsed.get, reverse=True)
+
+    if policy.get('latest_patch'):
+        series = set()
+        latest = []
+        for version in ordered:
+            minor = parsed[version].release[:2]
+            if minor not in series:
+                series.add(minor)
+                latest.append(version)
+        ordered = latest
+
+    if policy.get('keep'):
+        ordered = ordered[:policy['keep']]
+
+    return kept | set(ordered)
+
+
+def _apply_retention(pkg_versions, retention):
+    """
+        Prune @pkg_versions in place according to the per-package
+        @retention policies, see retained_versions().
+    """
+    for package, policy in (retention or {}).items():
+        p_name = travis_variable_name(package)
+        if p_name in pkg_versions:
+            pkg_versions[p_name] &= retained_versions(pkg_versions[p_name],
+                                                      policy)
+
+
+def build_travis_env(travis, package, new_version, retention=None):
+    """
+        Given a YAML object returns an environment
+        dict containing all packages and versions including the
+        new one.
+
+        NOTE: the result is groupped by package names which appear
+        on the same line!
+
+        @retention - optional dict of package names and the retention
+                     policy for their versions, see retained_versions()
+    """
+    lines, pkg_versions = _parse_travis_env(travis['env'])
+
+    # add the new version to the list
+    new_pkg_name = travis_variable_name(package)
+    if new_pkg_name in pkg_versions:
+        pkg_versions[new_pkg_name].add(new_version)
+
+    _apply_retention(pkg_versions, retention)
+
+    # for each group of packages, assign the versions which
+    # apply to it
+    groups = {}
+    for pkgs in lines:
+        groups[pkgs] = {}
+        for p_name in pkgs:
+            groups[pkgs][p_name] = pkg_versions[p_name]
+
+    return groups
+
+
+def covering_array(pools, strength=2):
+    """
+        Greedily build a t-way covering array: a list of rows (tuples
+        with one value from each pool) such that for every @strength
+        pools each combination of their values appears in at least one
+        row. With strength=2 this is the classic all-pairs set which
+        grows roughly logarithmically with the number of pools instead of
+        exponentially like the full product.
+
+        When @strength is not smaller than the number of pools the full
+        Cartesian product is returned. A @strength smaller than 1 would
+        drop values and raises ValueError.
+    """
+    if strength < 1:
+        raise ValueError('strength must be at least 1, got %r' % strength)
+
+    pools = [list(pool) for pool in pools]
+    if strength >= len(pools):
+        return list(product(*pools))
+
+    # every interaction is a tuple of (pool index, value) pairs
+    uncovered = set()
+    for indexes in combinations(range(len(pools)), strength):
+        for values in product(*[pools[i] for i in indexes]):
+            uncovered.add(tuple(zip(indexes, values)))
+
+    def _covered_by(row):
+        covered = set()
+        for indexes in combinations(sorted(row), strength):
+            interaction = tuple((i, row[i]) for i in indexes)
+            if interaction in uncovered:
+                covered.add(interaction)
+        return covered
+
+    rows = []
+    while uncovered:
+        # start from an interaction which isn't covered yet and pick the
+        # remaining values so that each covers the most new interactions
+        row = dict(min(uncovered))
+        for i, pool in enumerate(pools):
+            if i in row:
+                continue
+            best_value, best_count = pool[0], -1
+            for value in pool:
+                row[i] = value
+                count = len(_covered_by(row))
+                if count > best_count:
+                    best_value, best_count = value, count
+            row[i] = best_value
+
+        uncovered -= _covered_by(row)
+        rows.append(tuple(row[i] for i in range(len(pools))))
+
+    return rows
+
+
+def iter_travis_env(groups, strength=None):
+    """
+        Lazily yield the lines of the environment matrix in sorted order,
+        see calculate_new_travis_env().
+
+        Every group yields its lines already sorted because keys and
+        versions are iterated in sorted order and the separator between
+        variables sorts before any other character. The groups are then
+        merged in a single pass so neither the full list of lines nor
+        the product tuples are ever kept in memory.
+
+        @strength - int - if given each group is reduced to a covering
+                array of this strength instead of the full product,
+                see covering_array()
+    """
+    streams = []
+    for pkgs in groups:
+        # each element of intermediate are the "key=version" strings
+        # for a particular package, ordered as they will appear in the
+        # final line
+        intermediate = [
+            ["%s=%s" % (key, version)
+             for version in sorted(groups[pkgs][key], key=str)]
+            for key in sorted(groups[pkgs].keys())
+        ]
+        if strength is None:
+            streams.append(' '.join(p) for p in product(*intermediate))
+        else:
+            streams.append(sorted(' '.join(p) for p in
+                                  covering_array(intermediate, strength)))
+
+    return heapq.merge(*streams)
+
+
+def calculate_new_travis_env(groups, strength=None):
+    """
+        Rebuilds the environment matrix as Cartesian product of all
+        environment variables (aka packages) and their values (aka versions)
+
+        NOTE: only takes into account variables which are listed on that
+        particular line!
+
+        @strength - int - optional, build a t-way covering array instead of
+                the full product. Every version still appears in at least
+                one line but the number of lines grows much slower.
+    """
+    # each element is a single combination of all packages and
+    # versions. this represents one line in the travis environment
+    return list(iter_travis_env(groups, strength))
+
+
+def update_travis_incremental(travis, package, new_version, retention=None):
+    """
+        Same as update_travis() but only the combinations which contain
+        @new_version are generated. They are inserted after the last line
+        of every group which lists the package while all existing lines
+        and their order are left untouched, except for lines with
+        versions dropped by the @retention policy.
+
+        Variables on the new lines appear in the same order as on the
+        existing lines of their group.
+    """
+    groups, pkg_versions = _parse_travis_env(travis['env'])
+
+    new_pkg_name = travis_variable_name(package)
+    if (new_pkg_name not in pkg_versions or
+            new_version in pkg_versions[new_pkg_name]):
+        return travis
+
+    retained = None
+    if retention:
+        retained = dict((p_name, set(versions))
+                        for p_name, versions in pkg_versions.items())
+        retained[new_pkg_name].add(new_version)
+        _apply_retention(retained, retention)
+        if new_version not in retained[new_pkg_name]:
+            # older than everything we keep
+            return travis
+        pkg_versions = retained
+
+    new_env = list(travis['env'])
+
+    # insert from the bottom up so that indexes of the groups
+    # above don't change
+    for pkgs, index in sorted(groups.items(), key=lambda g: g[1],
+                              reverse=True):
+        if new_pkg_name not in pkgs:
+            continue
+
+        intermediate = []
+        for p_name in pkgs:
+            if p_name == new_pkg_name:
+                versions = [new_version]
+            else:
+                versions = sorted(pkg_versions[p_name])
+            intermediate.append(["%s=%s" % (p_name, v) for v in versions])
+
+        new_env[index + 1:index + 1] = [' '.join(p)
+                                        for p in product(*intermediate)]
+
+    if retained is not None:
+        # drop the lines with versions which are no longer retained
+        new_env = [line for line in new_env
+                   if all(variable.split('=')[1] in
+                          retained[variable.split('=')[0]]
+                          for variable in line.split(' '))]
+
+    new_travis = travis.copy()
+    new_travis['env'] = new_env
+    return new_travis
+
+
+def update_travis(travis, package, new_version, incremental=False,
+                  strength=None, retention=None):
+    """
+        Parses .travis.yml, builds a list of package==version
+        from the environment and updates the environment if
+        the new version is not listed there.
+
+        @travis - YAML object of a .travis.yml file
+        @package - string - package name
+        @new_version - string - the version string
+        @incremental - bool - see update_travis_incremental()
+        @strength - int - see calculate_new_travis_env(). Has no effect
+                together with @incremental
+        @retention - dict - per package retention policy which bounds the
+                number of versions in the matrix, see retained_versions()
+
+        @return - string - the new contents of the file
+    """
+    # pylint: disable=too-many-arguments
+    if incremental:
+        new_travis = update_travis_incremental(travis, package, new_version,
+                                               retention)
+    else:
+        # build the environment list incl. the latest version
+        env_vars = build_travis_env(travis, package, new_version, retention)
+        # and rebuild all combinations
+        new_travis = travis.copy()
+        new_travis['env'] = calculate_new_travis_env(env_vars, strength)
+
+    metrics.observe('strazar_matrix_rows_before', len(travis['env']),
+                    buckets=Metrics.ROWS_BUCKETS)
+    metrics.observe('strazar_matrix_rows_after', len(new_travis['env']),
+                    buckets=Metrics.ROWS_BUCKETS)
+    return new_travis
+
+
+def _render_env_line(line, style, indent):
+    if style in ('"', "'"):
+        value = dump_yaml(line, default_style=style, width=4096).rstrip()
+        if value.endswith('...'):
+            value = value[:-3].rstrip()
+    else:
+        value = line
+    return "%s- %s\n" % (indent, value)
+
+
+def _env_ranges(text):
+    """
+        Locate the entries of env in @text.
+
+        @return - tuple (ranges, nodes) where ranges holds the [start, end)
+                  of every entry, from the beginning of its line up to and
+                  including the line break after it. None if env isn't a
+                  non-empty block sequence of scalars.
+    """
+    yaml = _import_yaml()
+    root = yaml.compose(text, Loader=yaml.SafeLoader)
+    if not isinstance(root, yaml.MappingNode):
+        return None
+
+    env_node = None
+    for key_node, value_node in root.value:
+        if key_node.value == 'env':
+            env_node = value_node
+    if (not isinstance(env_node, yaml.SequenceNode) or env_node.flow_style or
+            not env_node.value):
+        return None
+
+    ranges = []
+    for item in env_node.value:
+        if not isinstance(item, yaml.ScalarNode):
+            return None
+        start = text.rfind('\n', 0, item.start_mark.index) + 1
+        end = text.find('\n', item.end_mark.index) + 1
+        ranges.append((start, end))
+    return ranges, env_node.value
+
+
+def _merge_env(text, ranges, old_env, new_env, render):
+    """
+        Returns @text with the entries at @ranges changed from @old_env to
+        @new_env. New entries are formatted by @render.
+    """
+    import difflib
+
+    # text between entries, e.g. comments or empty lines, is kept and
+    # placed before the next original entry
+    result = [text[:ranges[0][0]]]
+    pending = ''
+    matcher = difflib.SequenceMatcher(None, old_env, new_env, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        for i in range(i1, i2):
+            result.append(pending)
+            if tag == 'equal':
+                result.append(text[ranges[i][0]:ranges[i][1]])
+            if i + 1 < len(ranges):
+                pending = text[ranges[i][1]:ranges[i + 1][0]]
+            else:
+                pending = ''
+        if tag in ('insert', 'replace'):
+            result.extend([render(line) for line in new_env[j1:j2]])
+    result.append(pending)
+    result.append(text[ranges[-1][1]:])
+    return ''.join(result)
+
+
+def patch_travis_env(text, old_travis, new_travis):
+    """
+        Apply the changes between old_travis['env'] and new_travis['env']
+        directly to @text, the original contents of .travis.yml. Only the
+        lines of added or removed entries change, everything else in the
+        file, including comments, stays byte-for-byte the same. New lines
+        are formatted like the first existing entry.
+
+        @return - string - the patched text or None when the file can't be
+                  patched, e.g. because env isn't a block sequence or keys
+                  other than env changed
+    """
+    old_rest = dict((k, v) for k, v in old_travis.items() if k != 'env')
+    new_rest = dict((k, v) for k, v in new_travis.items() if k != 'env')
+    if old_rest != new_rest:
+        return None
+
+    if not text.endswith('\n'):
+        text += '\n'
+
+    located = _env_ranges(text)
+    if located is None:
+        return None
+    ranges, items = located
+
+    first_line = text[ranges[0][0]:ranges[0][1]]
+    indent = first_line[:len(first_line) - len(first_line.lstrip())]
+    style = items[0].style
+
+    patched = _merge_env(text, ranges, [item.value for item in items],
+                         new_travis['env'],
+                         lambda line: _render_env_line(line, style, indent))
+    if load_yaml(patched) != new_travis:
+        return None
+    return patched
@@ -1,6 +1,6 @@
 #!/bin/bash
 
-flake8 strazar/__init__.py && \
+flake8 strazar/ && \
 pylint -rn strazar tests/*.py && \
 coverage run --source strazar/ --branch -m unittest discover tests/ -v && \
 coverage report -m
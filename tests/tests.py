@@ -1,18 +1,35 @@
 # -*- coding: utf-8 -*-
-# pylint: disable=invalid-name,line-too-long,missing-docstring,no-member
+# pylint: disable=invalid-name,line-too-long,missing-docstring,no-member,protected-access,too-many-lines
 # workaround for https://github.com/PyCQA/pylint/issues/1609
 #pylint: disable=unused-variable
 
+import io
 import os
+import gzip
+import zlib
+import itertools
+import asyncio
+import json
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-try:
-    import unittest.mock as mock
-except ImportError:
-    import mock
+from unittest import mock
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
 
 import yaml
 import strazar
+import strazar.aio
+import strazar.cli
 
 
 _url_mock_values = {
@@ -49,6 +66,21 @@ _url_mock_values = {
             "content": "bGFuZ3VhZ2U6IHB5dGhvbgpweXRob246CiAgLSAyLjcKICAtIDMuNQppbnN0YWxsOgogIC0gcGlwIGluc3RhbGwgY292ZXJhZ2UgZmxha2U4IG1vY2sgUHlZQU1MPT0kX1BZWUFNTCBQeUdpdGh1Yj09JF9QWUdJVEhVQgpzY3JpcHQ6CiAgLSAuL3Rlc3Quc2gKZW52OgogIC0gX1BZR0lUSFVCPTEuMjYuMCBfUFlZQU1MPTMuMTEK",
             "encoding": "base64"
         },
+        '/repos/MrSenko/strazar/commits/master': {
+            "sha": "2c00076236089e8713afb69799205e043d0068d8",
+            "commit": {
+                "tree": {
+                    "sha": "175b571e84ae67a54a3fb46ae0be9ccc39c8efb6",
+                },
+                "message": "Added .travis.yml",
+            },
+        },
+        '/repos/MrSenko/strazar/contents/.travis.yml?ref=2c00076236089e8713afb69799205e043d0068d8': {
+            "path": ".travis.yml",
+            "sha": "c7a421dc1d3d7124e21a49dfcfac9be3e926cd89",
+            "content": "bGFuZ3VhZ2U6IHB5dGhvbgpweXRob246CiAgLSAyLjcKICAtIDMuNQppbnN0YWxsOgogIC0gcGlwIGluc3RhbGwgY292ZXJhZ2UgZmxha2U4IG1vY2sgUHlZQU1MPT0kX1BZWUFNTCBQeUdpdGh1Yj09JF9QWUdJVEhVQgpzY3JpcHQ6CiAgLSAuL3Rlc3Quc2gKZW52OgogIC0gX1BZR0lUSFVCPTEuMjYuMCBfUFlZQU1MPTMuMTEK",
+            "encoding": "base64"
+        },
     },
     True: {
         '/repos/MrSenko/strazar/git/blobs': {
@@ -72,7 +104,7 @@ _url_mock_values = {
     }
 }
 
-def _get_url_mock(url, push_data=None):
+def _get_url_mock(url, push_data=None, compress=False):  # pylint: disable=unused-argument
     request = _url_mock_values[push_data is not None]
 
     if url in request:
@@ -82,6 +114,593 @@ def _get_url_mock(url, push_data=None):
 
 
 
+class _LocalHandler(BaseHTTPRequestHandler):
+    """
+        Serves JSON from self.server.responses and records every
+        request and new connection for later inspection.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def _respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+        self.server.requests.append((self.command, self.path,
+                                     dict(self.headers), body))
+        status, headers, data = self.server.responses.get(
+            self.path, (404, {}, b''))
+        if callable(data):
+            response = data(self)
+            if response is None:
+                # the callable answered on its own
+                return
+            status, headers, data = response
+        if not isinstance(data, bytes):
+            data = json.dumps(data).encode('UTF-8')
+            headers = dict(headers, **{'Content-Type': 'application/json'})
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _LocalServer(object):
+    def __init__(self):
+        self.httpd = _ThreadingHTTPServer(('127.0.0.1', 0), _LocalHandler)
+        self.httpd.connections = 0
+        self.httpd.requests = []
+        self.httpd.responses = {}
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self.httpd
+
+    def __exit__(self, *args):
+        strazar.net._pool.clear()
+        strazar.net._limiter.clear()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class StrazarHttpTestCase(unittest.TestCase):
+    """
+        Tests for get_url() and the connection pool
+    """
+
+    def test_get_url_reuses_keep_alive_connection(self):
+        """
+            WHEN get_url() is called several times for the same host
+            THEN a single keep-alive connection is used
+        """
+        server = _LocalServer()
+        with server as httpd:
+            httpd.responses['/data'] = (200, {}, {'answer': 42})
+            for _ in range(3):
+                self.assertEqual(strazar.get_url(server.url + '/data'),
+                                 {'answer': 42})
+            self.assertEqual(len(httpd.requests), 3)
+            self.assertEqual(httpd.connections, 1)
+
+    def test_get_url_reconnects_when_server_closes_connection(self):
+        """
+            WHEN the server closes an idle keep-alive connection
+            THEN get_url() reconnects transparently
+        """
+        server = _LocalServer()
+        with server as httpd:
+            httpd.responses['/data'] = (200, {}, {'answer': 42})
+            strazar.get_url(server.url + '/data')
+            # simulate the idle connections being dropped
+            for conns in strazar.net._pool._idle.values():
+                for conn in conns:
+                    conn.sock.shutdown(2)
+            self.assertEqual(strazar.get_url(server.url + '/data'),
+                             {'answer': 42})
+            self.assertEqual(httpd.connections, 2)
+
+    def test_get_url_does_not_resend_after_read_timeout(self):
+        """
+            GIVEN a reused keep-alive connection
+            WHEN the server doesn't answer within read_timeout
+            THEN the request is not sent again
+        """
+        def _slow_response(_handler):
+            time.sleep(0.5)
+            return 200, {}, {'sha': 'new-commit'}
+
+        strazar.configure_connection_pool(read_timeout=0.1)
+        server = _LocalServer()
+        try:
+            with server as httpd:
+                httpd.responses['/data'] = (200, {}, {'answer': 42})
+                httpd.responses['/commits'] = (None, None, _slow_response)
+                strazar.get_url(server.url + '/data')
+                with self.assertRaises(Exception):
+                    strazar.post_url(server.url + '/commits', {'tree': 'x'})
+                self.assertEqual([r[1] for r in httpd.requests],
+                                 ['/data', '/commits'])
+        finally:
+            strazar.configure_connection_pool()
+
+    def test_get_url_does_not_resend_after_reset_mid_body(self):
+        """
+            GIVEN a reused keep-alive connection
+            WHEN the server resets it while sending the response body
+            THEN the request is not sent again
+        """
+        def _reset_mid_body(handler):
+            handler.send_response(200)
+            handler.send_header('Content-Length', '1000')
+            handler.end_headers()
+            handler.wfile.write(b'{"sha": ')
+            handler.wfile.flush()
+            # close with a RST instead of a FIN
+            handler.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                          struct.pack('ii', 1, 0))
+            handler.rfile.close()
+            handler.wfile.close()
+            handler.connection.close()
+            handler.wfile = io.BytesIO()
+            handler.close_connection = True
+
+        server = _LocalServer()
+        with server as httpd:
+            httpd.responses['/data'] = (200, {}, {'answer': 42})
+            httpd.responses['/commits'] = (None, None, _reset_mid_body)
+            strazar.get_url(server.url + '/data')
+            with self.assertRaises(Exception):
+                strazar.post_url(server.url + '/commits', {'tree': 'x'})
+            self.assertEqual([r[1] for r in httpd.requests],
+                             ['/data', '/commits'])
+
+    def test_get_url_decodes_compressed_responses(self):
+        """
+            WHEN get_url() is called
+            THEN it asks for compressed responses
+            AND decodes gzip and deflate encoded bodies
+        """
+        body = json.dumps({'tree': ['.travis.yml'] * 1000}).encode('UTF-8')
+        raw_deflate = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+        server = _LocalServer()
+        with server as httpd:
+            httpd.responses['/gzip'] = (200, {'Content-Encoding': 'gzip'},
+                                        gzip.compress(body))
+            httpd.responses['/deflate'] = (
+                200, {'Content-Encoding': 'deflate'}, zlib.compress(body))
+            httpd.responses['/raw-deflate'] = (
+                200, {'Content-Encoding': 'deflate'},
+                raw_deflate.compress(body) + raw_deflate.flush())
+            for path in ('/gzip', '/deflate', '/raw-deflate'):
+                self.assertEqual(strazar.get_url(server.url + path),
+                                 {'tree': ['.travis.yml'] * 1000})
+            self.assertEqual(httpd.requests[0][2]['Accept-Encoding'],
+                             'gzip, deflate')
+
+    def test_post_url_compressed(self):
+        """
+            WHEN post_url() is called with compress=True
+            THEN large bodies are sent gzip encoded
+            AND small ones as they are
+        """
+        server = _LocalServer()
+        with server as httpd:
+            httpd.responses['/blobs'] = (200, {}, {'sha': 'new-blob'})
+            content = {'content': 'env:\n' * 1000, 'encoding': 'utf-8'}
+            strazar.post_url(server.url + '/blobs', content, compress=True)
+            strazar.post_url(server.url + '/blobs', {'q': 1}, compress=True)
+
+            _, _, headers, body = httpd.requests[0]
+            self.assertEqual(headers['Content-Encoding'], 'gzip')
+            self.assertLess(len(body), 1000)
+            self.assertEqual(json.loads(gzip.decompress(body).decode('UTF-8')),
+                             content)
+
+            _, _, headers, body = httpd.requests[1]
+            self.assertNotIn('Content-Encoding', headers)
+            self.assertEqual(json.loads(body.decode('UTF-8')), {'q': 1})
+
+    def test_get_url_response_formats(self):
+        """
+            WHEN get_url() is called
+            THEN the body is decoded according to its Content-Type
+            AND returned as bytes or a stream if requested
+        """
+        server = _LocalServer()
+        with server as httpd:
+            httpd.responses['/json'] = (
+                200, {'Content-Type': 'application/vnd.github.v3+json'},
+                b'{"sha": "abc"}')
+            httpd.responses['/feed'] = (
+                200, {'Content-Type': 'text/xml; charset=ISO-8859-1'},
+                u'<title>Stra\u017ear</title>'.encode('UTF-8'))
+            httpd.responses['/latin'] = (
+                200, {'Content-Type': 'text/plain; charset=ISO-8859-1'},
+                u'caf\xe9'.encode('ISO-8859-1'))
+            httpd.responses['/text'] = (200, {'Content-Type': 'text/plain'},
+                                        b'{"not": "parsed"}')
+
+            self.assertEqual(strazar.get_url(server.url + '/json'),
+                             {'sha': 'abc'})
+            self.assertEqual(strazar.get_url(server.url + '/latin'),
+                             u'caf\xe9')
+            self.assertEqual(strazar.get_url(server.url + '/text'),
+                             '{"not": "parsed"}')
+            self.assertEqual(strazar.get_url(server.url + '/json', raw=True),
+                             b'{"sha": "abc"}')
+            stream = strazar.get_url(server.url + '/feed', stream=True)
+            self.assertEqual(stream.read(),
+                             u'<title>Stra\u017ear</title>'.encode('UTF-8'))
+
+    def test_json_is_parsed_with_orjson_when_installed(self):
+        """
+            WHEN orjson is installed
+            THEN it parses JSON responses
+            AND the standard library is used otherwise
+        """
+        _orig_orjson = strazar.net.orjson
+        try:
+            strazar.net.orjson = mock.MagicMock()
+            strazar.net.orjson.loads.return_value = {'sha': 'abc'}
+            self.assertEqual(strazar.net._json_loads(b'{"sha": "abc"}'),
+                             {'sha': 'abc'})
+            strazar.net.orjson.loads.assert_called_once_with(b'{"sha": "abc"}')
+
+            strazar.net.orjson = False
+            self.assertEqual(strazar.net._json_loads(b'{"sha": "abc"}'),
+                             {'sha': 'abc'})
+        finally:
+            strazar.net.orjson = _orig_orjson
+
+    def test_get_url_conditional_request_served_from_cache(self):
+        """
+            GIVEN the HTTP cache is enabled
+            WHEN the server answers 304 Not Modified
+            THEN get_url() returns the previously cached body
+        """
+        def _etag_response(handler):
+            if handler.headers.get('If-None-Match') == '"v1"':
+                return 304, {}, b''
+            return 200, {'ETag': '"v1"'}, {'sha': 'abc'}
+
+        cache_dir = tempfile.mkdtemp()
+        strazar.configure_http_cache(cache_dir)
+        server = _LocalServer()
+        try:
+            with server as httpd:
+                httpd.responses['/ref'] = (None, None, _etag_response)
+                self.assertEqual(strazar.get_url(server.url + '/ref'),
+                                 {'sha': 'abc'})
+                self.assertEqual(strazar.get_url(server.url + '/ref'),
+                                 {'sha': 'abc'})
+                self.assertNotIn('If-None-Match', httpd.requests[0][2])
+                self.assertEqual(httpd.requests[1][2]['If-None-Match'],
+                                 '"v1"')
+        finally:
+            strazar.configure_http_cache(None)
+            shutil.rmtree(cache_dir)
+
+    def test_get_url_cache_write_error(self):
+        """
+            GIVEN the HTTP cache is enabled
+            WHEN the response can't be written to the cache
+            THEN get_url() still returns it
+        """
+        cache_dir = tempfile.mkdtemp()
+        strazar.configure_http_cache(cache_dir)
+        shutil.rmtree(cache_dir)
+        server = _LocalServer()
+        try:
+            with server as httpd:
+                httpd.responses['/ref'] = (200, {'ETag': '"v1"'},
+                                           {'sha': 'abc'})
+                with mock.patch('sys.stdout', new_callable=io.StringIO):
+                    self.assertEqual(strazar.get_url(server.url + '/ref'),
+                                     {'sha': 'abc'})
+                self.assertEqual(len(httpd.requests), 1)
+        finally:
+            strazar.configure_http_cache(None)
+
+    def test_http_cache_keeps_fresh_temporary_files(self):
+        """
+            GIVEN a cache directory shared with another process
+            WHEN a new HTTPCache is created
+            THEN only stale temporary files are removed
+        """
+        cache_dir = tempfile.mkdtemp()
+        try:
+            fresh = os.path.join(cache_dir, '.fresh.1.1')
+            stale = os.path.join(cache_dir, '.stale.1.1')
+            for name in (fresh, stale):
+                with open(name, 'wb') as tmp_file:
+                    tmp_file.write(b'{}\n')
+            old = time.time() - strazar.net.CACHE_TMP_MAX_AGE - 60
+            os.utime(stale, (old, old))
+
+            strazar.HTTPCache(cache_dir)
+            self.assertEqual(os.listdir(cache_dir), ['.fresh.1.1'])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_http_cache_evicts_least_recently_used(self):
+        """
+            WHEN more than max_entries responses are cached
+            THEN the least recently used entry is evicted
+        """
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = strazar.HTTPCache(cache_dir, max_entries=2)
+            cache.set('/a', {'etag': 'a'}, b'A')
+            cache.set('/b', {'etag': 'b'}, b'B')
+            # touch /a so that /b becomes the oldest entry
+            self.assertEqual(cache.get('/a'), ({'etag': 'a'}, b'A'))
+            cache.set('/c', {'etag': 'c'}, b'C')
+
+            self.assertIsNone(cache.get('/b'))
+            self.assertEqual(cache.get('/c'), ({'etag': 'c'}, b'C'))
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_http_cache_set_is_atomic(self):
+        """
+            WHEN writing a cache entry fails half way
+            THEN the previous entry is still served
+            AND no temporary files are left behind
+        """
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = strazar.HTTPCache(cache_dir)
+            cache.set('/tree', {'etag': 'a'}, b'complete body')
+            with self.assertRaises(TypeError):
+                # the body isn't bytes
+                cache.set('/tree', {'etag': 'b'}, None)
+
+            self.assertEqual(cache.get('/tree'),
+                             ({'etag': 'a'}, b'complete body'))
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_write_atomic_concurrent_writers(self):
+        """
+            WHEN several threads replace the same file at once
+            THEN none of them fails
+            AND the file holds one complete write
+            AND no temporary files are left behind
+        """
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, 'state.json')
+        errors = []
+
+        def _writer(value):
+            try:
+                for _ in range(200):
+                    strazar.files.write_atomic(path, json.dumps(
+                        {'serial': value}))
+            except Exception as e:  # pylint: disable=broad-except
+                errors.append(e)
+
+        try:
+            threads = [threading.Thread(target=_writer, args=(value,))
+                       for value in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(errors, [])
+            with open(path) as state_file:
+                self.assertIn(json.load(state_file)['serial'], range(4))
+            self.assertEqual(os.listdir(tmp_dir), ['state.json'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class StrazarRateLimiterTestCase(unittest.TestCase):
+    """
+        Tests for RateLimiter
+    """
+    def test_requests_are_paced_over_the_reset_window(self):
+        """
+            GIVEN the server reported the remaining quota
+            WHEN more requests than the burst size are made
+            THEN the remaining ones are spread until the reset
+        """
+        limiter = strazar.RateLimiter(burst=2, clock=lambda: 1000)
+        self.assertEqual(limiter.delay('api.github.com'), 0)
+
+        self.assertFalse(limiter.update('api.github.com', 200, [
+            ('X-RateLimit-Remaining', '10'),
+            ('X-RateLimit-Reset', '1100'),
+        ]))
+        self.assertEqual(limiter.delay('api.github.com'), 0)
+        self.assertEqual(limiter.delay('api.github.com'), 0)
+        # 8 requests left for 100 seconds
+        self.assertEqual(limiter.delay('api.github.com'), 12.5)
+        # other hosts are not affected
+        self.assertEqual(limiter.delay('pypi.org'), 0)
+
+    def test_exhausted_quota_defers_until_reset(self):
+        """
+            WHEN the quota is exhausted
+            THEN the request is reported as rate limited
+            AND the next request waits for the reset
+        """
+        limiter = strazar.RateLimiter(clock=lambda: 1000)
+        self.assertTrue(limiter.update('api.github.com', 403, [
+            ('X-RateLimit-Remaining', '0'),
+            ('X-RateLimit-Reset', '1600'),
+        ]))
+        self.assertEqual(limiter.delay('api.github.com'), 600)
+
+    def test_retry_after(self):
+        """
+            WHEN the server answers with Retry-After
+            THEN the next request waits that long
+        """
+        limiter = strazar.RateLimiter(clock=lambda: 1000)
+        self.assertTrue(limiter.update('api.github.com', 429, [
+            ('Retry-After', '30'),
+        ]))
+        self.assertEqual(limiter.delay('api.github.com'), 30)
+
+    def test_get_url_retries_rate_limited_request(self):
+        """
+            WHEN the server rejects a request because of the rate limit
+            THEN get_url() waits and sends it again
+        """
+        responses = [
+            (429, {'Retry-After': '0'}, {'message': 'slow down'}),
+            (200, {'X-RateLimit-Remaining': '99',
+                   'X-RateLimit-Reset': str(int(time.time()) + 60)},
+             {'answer': 42}),
+        ]
+
+        server = _LocalServer()
+        with server as httpd:
+            httpd.responses['/data'] = (None, None,
+                                        lambda handler: responses.pop(0))
+            self.assertEqual(strazar.get_url(server.url + '/data'),
+                             {'answer': 42})
+            self.assertEqual(len(httpd.requests), 2)
+
+
+class StrazarAsyncTestCase(unittest.TestCase):
+    """
+        Tests for the asyncio API in strazar.aio
+    """
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_get_url_async(self):
+        """
+            WHEN get_url_async() is called
+            THEN the same result as with get_url() is returned
+        """
+        server = _LocalServer()
+        with server as httpd:
+            httpd.responses['/data'] = (200, {}, {'answer': 42})
+            result = self.loop.run_until_complete(
+                strazar.aio.get_url_async(server.url + '/data'))
+            self.assertEqual(result, {'answer': 42})
+
+            result = self.loop.run_until_complete(
+                strazar.aio.post_url_async(server.url + '/data', {'q': 1}))
+            self.assertEqual(result, {'answer': 42})
+            self.assertEqual(httpd.requests[1][0], 'POST')
+            self.assertEqual(json.loads(httpd.requests[1][3].decode('UTF-8')),
+                             {'q': 1})
+
+    def test_get_url_async_compressed_response(self):
+        """
+            WHEN the server sends a gzip encoded body
+            THEN get_url_async() decodes it
+        """
+        server = _LocalServer()
+        with server as httpd:
+            httpd.responses['/data'] = (
+                200, {'Content-Encoding': 'gzip'},
+                gzip.compress(json.dumps({'answer': 42}).encode('UTF-8')))
+            result = self.loop.run_until_complete(
+                strazar.aio.get_url_async(server.url + '/data'))
+            self.assertEqual(result, {'answer': 42})
+
+    def test_update_github_async(self):
+        """
+            WHEN there's a new package version
+            THEN update_github_async() pushes the change to GitHub
+        """
+        async def _get_url_async_mock(url, post_data=None, compress=False):
+            await asyncio.sleep(0)
+            return _get_url_mock(url, post_data, compress)
+
+        _orig_get_url_async = strazar.aio.get_url_async
+        strazar.aio.get_url_async = _get_url_async_mock
+        os.environ['GITHUB_TOKEN'] = 'testing'
+        try:
+            ret = self.loop.run_until_complete(
+                strazar.aio.update_github_async(GITHUB_REPO='MrSenko/strazar',
+                                                GITHUB_BRANCH='master',
+                                                GITHUB_FILE='.travis.yml',
+                                                name='PyYAML', version='3.12'))
+            self.assertTrue(ret)
+        finally:
+            strazar.aio.get_url_async = _orig_get_url_async
+            del os.environ['GITHUB_TOKEN']
+
+    def test_monitor_pypi_rss_async(self):
+        """
+            WHEN monitor_pypi_rss_async() finds packages from config
+            THEN coroutine and plain callbacks are executed
+            AND at most `concurrency` callbacks run at the same time
+        """
+        running = []
+        max_running = []
+
+        async def _async_callback(**kwargs):
+            running.append(kwargs['GITHUB_REPO'])
+            max_running.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(kwargs['GITHUB_REPO'])
+            return kwargs['GITHUB_REPO']
+
+        _plain_callback = mock.MagicMock(return_value=True)
+        config = {
+            'PyYAML': [{'cb': _async_callback,
+                        'args': {'GITHUB_REPO': 'repo%d' % i}}
+                       for i in range(5)],
+            'Django': [{'cb': _plain_callback, 'args': {}}],
+        }
+        feed = io.BytesIO(b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="0.91">
+ <channel>
+  <item>
+    <title>PyYAML 3.12</title>
+    <pubDate>12 May 2016 21:45:18 GMT</pubDate>
+  </item>
+  <item>
+    <title>Django 1.10</title>
+    <pubDate>12 May 2016 21:40:00 GMT</pubDate>
+  </item>
+ </channel>
+</rss>""")
+        results = self.loop.run_until_complete(
+            strazar.aio.monitor_pypi_rss_async(config, feed=feed,
+                                               concurrency=2))
+
+        self.assertEqual([r['result'] for r in results],
+                         ['repo0', 'repo1', 'repo2', 'repo3', 'repo4', True])
+        self.assertEqual(max(max_running), 2)
+        _plain_callback.assert_called_once_with(
+            name='Django', version='1.10',
+            released_on=datetime(2016, 5, 12, 21, 40, 0))
+
+
 class StrazarGitHubTestCase(unittest.TestCase):
     """
         Tests related to GitHub functionality
@@ -120,22 +739,274 @@ class StrazarGitHubTestCase(unittest.TestCase):
             strazar.get_url = _orig_get_url
             del os.environ['GITHUB_TOKEN']
 
+    def test_update_github_with_multiple_updates(self):
+        """
+            WHEN update_github() receives several package updates
+            THEN all of them are applied to .travis.yml
+            AND pushed as a single commit
+        """
+        kwargs = {
+            'GITHUB_REPO' : 'MrSenko/strazar',
+            'GITHUB_BRANCH' : 'master',
+            'GITHUB_FILE' : '.travis.yml',
+            'updates': [('PyYAML', '3.12'), ('PyGithub', '1.27.1')],
+        }
+
+        _orig_get_url = strazar.get_url
+        _get_url = strazar.get_url = mock.MagicMock(side_effect=_get_url_mock)
+        os.environ['GITHUB_TOKEN'] = 'testing'
+        try:
+            ret = strazar.update_github(**kwargs)
+            self.assertTrue(ret)
+        finally:
+            strazar.get_url = _orig_get_url
+            del os.environ['GITHUB_TOKEN']
+
+        posted = dict((c[0][0], c[0][1]) for c in _get_url.call_args_list
+                      if len(c[0]) > 1)
+        self.assertEqual(len(posted), 4)
+        new_travis = yaml.safe_load(posted['/repos/MrSenko/strazar/git/blobs']['content'])
+        self.assertEqual(new_travis['env'], [
+            '_PYGITHUB=1.26.0 _PYYAML=3.11',
+            '_PYGITHUB=1.26.0 _PYYAML=3.12',
+            '_PYGITHUB=1.27.1 _PYYAML=3.11',
+            '_PYGITHUB=1.27.1 _PYYAML=3.12',
+        ])
+        self.assertEqual(posted['/repos/MrSenko/strazar/git/commits']['message'],
+                         'New dependencies PyYAML 3.12, PyGithub 1.27.1 found! Auto update .travis.yml')
+
+    def test_update_github_fast_read(self):
+        """
+            WHEN update_github() is called with fast_read=True
+            THEN the file is read with two requests without the tree listing
+            AND the commit is based on the same commit and tree
+        """
+        kwargs = {
+            'GITHUB_REPO' : 'MrSenko/strazar',
+            'GITHUB_BRANCH' : 'master',
+            'GITHUB_FILE' : '.travis.yml',
+            'name': 'PyYAML',
+            'version': '3.12',
+            'fast_read': True,
+        }
+
+        _orig_get_url = strazar.get_url
+        _get_url = strazar.get_url = mock.MagicMock(side_effect=_get_url_mock)
+        os.environ['GITHUB_TOKEN'] = 'testing'
+        try:
+            ret = strazar.update_github(**kwargs)
+            self.assertTrue(ret)
+        finally:
+            strazar.get_url = _orig_get_url
+            del os.environ['GITHUB_TOKEN']
+
+        reads = [c[0][0] for c in _get_url.call_args_list if len(c[0]) == 1]
+        self.assertEqual(reads, [
+            '/repos/MrSenko/strazar/commits/master',
+            '/repos/MrSenko/strazar/contents/.travis.yml?ref=2c00076236089e8713afb69799205e043d0068d8',
+        ])
+        posted = dict((c[0][0], c[0][1]) for c in _get_url.call_args_list
+                      if len(c[0]) > 1)
+        self.assertEqual(posted['/repos/MrSenko/strazar/git/trees']['base_tree'],
+                         '175b571e84ae67a54a3fb46ae0be9ccc39c8efb6')
+        self.assertEqual(posted['/repos/MrSenko/strazar/git/commits']['parents'],
+                         ['2c00076236089e8713afb69799205e043d0068d8'])
+
+    def test_update_github_fast_read_no_travis_yml_in_repository(self):
+        """
+            GIVEN there is no .travis.yml file in the repository
+            WHEN update_github() is called with fast_read=True
+            THEN RuntimeError is raised
+        """
+        def _return_values(url, post_data=None, compress=False):
+            if url.startswith('/repos/MrSenko/strazar/contents/'):
+                raise strazar.NotFound('404 - %s not found' % url)
+            return _get_url_mock(url, post_data, compress)
+
+        _orig_get_url = strazar.get_url
+        strazar.get_url = mock.MagicMock(side_effect=_return_values)
+        os.environ['GITHUB_TOKEN'] = 'testing'
+        try:
+            with self.assertRaises(RuntimeError):
+                strazar.update_github(GITHUB_REPO='MrSenko/strazar',
+                                      GITHUB_BRANCH='master',
+                                      GITHUB_FILE='.travis.yml',
+                                      name='PyYAML', version='3.12',
+                                      fast_read=True)
+        finally:
+            strazar.get_url = _orig_get_url
+            del os.environ['GITHUB_TOKEN']
+
+    def test_update_github_reads_repository_once_per_run(self):
+        """
+            GIVEN several updates for the same file in one run
+            WHEN update_github() is called for each of them
+            THEN the file is read from GitHub only once
+            AND later commits are based on the commit pushed before them
+        """
+        _orig_get_url = strazar.get_url
+        _get_url = strazar.get_url = mock.MagicMock(side_effect=_get_url_mock)
+        os.environ['GITHUB_TOKEN'] = 'testing'
+        try:
+            with strazar.repository_snapshots():
+                for name, version in (('PyYAML', '3.12'), ('PyGithub', '1.27.1')):
+                    ret = strazar.update_github(GITHUB_REPO='MrSenko/strazar',
+                                                GITHUB_BRANCH='master',
+                                                GITHUB_FILE='.travis.yml',
+                                                name=name, version=version)
+                    self.assertTrue(ret)
+        finally:
+            strazar.get_url = _orig_get_url
+            del os.environ['GITHUB_TOKEN']
+
+        reads = [c for c in _get_url.call_args_list if len(c[0]) == 1]
+        self.assertEqual(len(reads), 4)
+        commits = [c[0][1] for c in _get_url.call_args_list
+                   if c[0][0] == '/repos/MrSenko/strazar/git/commits']
+        trees = [c[0][1] for c in _get_url.call_args_list
+                 if c[0][0] == '/repos/MrSenko/strazar/git/trees']
+        self.assertEqual(commits[1]['parents'], ['new-commit'])
+        self.assertEqual(trees[1]['base_tree'], 'new-tree')
+
+    def test_update_github_patch(self):
+        """
+            WHEN update_github() is called with patch=True
+            THEN only the new env line is added to the original file
+        """
+        _orig_get_url = strazar.get_url
+        _get_url = strazar.get_url = mock.MagicMock(side_effect=_get_url_mock)
+        os.environ['GITHUB_TOKEN'] = 'testing'
+        try:
+            ret = strazar.update_github(GITHUB_REPO='MrSenko/strazar',
+                                        GITHUB_BRANCH='master',
+                                        GITHUB_FILE='.travis.yml',
+                                        name='PyYAML', version='3.12',
+                                        patch=True)
+            self.assertTrue(ret)
+        finally:
+            strazar.get_url = _orig_get_url
+            del os.environ['GITHUB_TOKEN']
+
+        blob = [c[0][1] for c in _get_url.call_args_list
+                if c[0][0] == '/repos/MrSenko/strazar/git/blobs'][0]
+        self.assertEqual(blob['content'], """language: python
+python:
+  - 2.7
+  - 3.5
+install:
+  - pip install coverage flake8 mock PyYAML==$_PYYAML PyGithub==$_PYGITHUB
+script:
+  - ./test.sh
+env:
+  - _PYGITHUB=1.26.0 _PYYAML=3.11
+  - _PYGITHUB=1.26.0 _PYYAML=3.12
+""")
+
+    def test_update_github_retries_transient_errors(self):
+        """
+            WHEN creating the blob fails with a server error
+            THEN the request is retried
+            AND the update succeeds
+        """
+        kwargs = {
+            'GITHUB_REPO' : 'MrSenko/strazar',
+            'GITHUB_BRANCH' : 'master',
+            'GITHUB_FILE' : '.travis.yml',
+            'name': 'PyYAML',
+            'version': '3.12',
+            'journal': None,
+        }
+        failures = [strazar.ServerError('502 - Bad Gateway')]
+
+        def _flaky_get_url(url, post_data=None, compress=False):
+            if url.endswith('/git/blobs') and failures:
+                raise failures.pop()
+            return _get_url_mock(url, post_data, compress)
+
+        _orig_get_url = strazar.get_url
+        _orig_backoff = strazar.github.RETRY_BACKOFF
+        _get_url = strazar.get_url = mock.MagicMock(side_effect=_flaky_get_url)
+        strazar.github.RETRY_BACKOFF = 0
+        os.environ['GITHUB_TOKEN'] = 'testing'
+        try:
+            self.assertTrue(strazar.update_github(**kwargs))
+        finally:
+            strazar.get_url = _orig_get_url
+            strazar.github.RETRY_BACKOFF = _orig_backoff
+            del os.environ['GITHUB_TOKEN']
+
+        posted = [c[0][0] for c in _get_url.call_args_list if len(c[0]) > 1]
+        self.assertEqual(posted, [
+            '/repos/MrSenko/strazar/git/blobs',
+            '/repos/MrSenko/strazar/git/blobs',
+            '/repos/MrSenko/strazar/git/trees',
+            '/repos/MrSenko/strazar/git/commits',
+            '/repos/MrSenko/strazar/git/refs/heads/master',
+        ])
+
+    def test_update_github_resumes_failed_write(self):
+        """
+            GIVEN a previous run created the blob and the tree
+            AND failed to create the commit
+            WHEN update_github() is executed again
+            THEN the blob and the tree are reused
+        """
+        kwargs = {
+            'GITHUB_REPO' : 'MrSenko/strazar',
+            'GITHUB_BRANCH' : 'master',
+            'GITHUB_FILE' : '.travis.yml',
+            'name': 'PyYAML',
+            'version': '3.12',
+        }
+
+        def _failing_get_url(url, post_data=None, compress=False):
+            if url.endswith('/git/commits') and post_data is not None:
+                raise strazar.ServerError('500 - Internal Server Error')
+            return _get_url_mock(url, post_data, compress)
+
+        tmp_dir = tempfile.mkdtemp()
+        journal_file = os.path.join(tmp_dir, 'journal.json')
+        _orig_get_url = strazar.get_url
+        os.environ['GITHUB_TOKEN'] = 'testing'
+        try:
+            strazar.get_url = mock.MagicMock(side_effect=_failing_get_url)
+            with self.assertRaises(strazar.ServerError):
+                strazar.update_github(
+                    journal=strazar.WriteJournal(journal_file), **kwargs)
+
+            _get_url = strazar.get_url = mock.MagicMock(side_effect=_get_url_mock)
+            self.assertTrue(strazar.update_github(
+                journal=strazar.WriteJournal(journal_file), **kwargs))
+
+            with open(journal_file) as f:
+                self.assertEqual(json.load(f), {})
+        finally:
+            strazar.get_url = _orig_get_url
+            del os.environ['GITHUB_TOKEN']
+            shutil.rmtree(tmp_dir)
+
+        posted = [c for c in _get_url.call_args_list if len(c[0]) > 1]
+        self.assertEqual(posted, [
+            mock.call('/repos/MrSenko/strazar/git/commits', {
+                'message': 'New dependency PyYAML 3.12 found! Auto update .travis.yml',
+                'parents': ['2c00076236089e8713afb69799205e043d0068d8'],
+                'tree': 'new-tree',
+            }, compress=False),
+            mock.call('/repos/MrSenko/strazar/git/refs/heads/master',
+                      {'sha': 'new-commit'}, compress=False),
+        ])
+
     def test_update_github_github_returning_error_on_push(self):
         """
             WHEN GitHub returns an error on push
             THEN it is handled correctly
         """
-        def _return_values(*args):
-            url = list(args)[0]
-            try:
-                post_data = list(args)[1]
-            except IndexError:
-                post_data = None
+        def _return_values(url, post_data=None, compress=False):
             if post_data and url == '/repos/MrSenko/strazar/git/refs/heads/master':
                 return {
                     "message": "Push to GitHub failed",
                 }
-            return _get_url_mock(url, post_data)
+            return _get_url_mock(url, post_data, compress)
 
         kwargs = {
             'GITHUB_REPO' : 'MrSenko/strazar',
@@ -157,6 +1028,35 @@ class StrazarGitHubTestCase(unittest.TestCase):
             strazar.get_url = _orig_get_url
             del os.environ['GITHUB_TOKEN']
 
+    def test_update_github_rejected_push_invalidates_snapshot(self):
+        """
+            GIVEN the branch was read during this run
+            WHEN GitHub rejects the update of the branch
+            THEN the snapshot of the branch is discarded
+        """
+        def _return_values(url, post_data=None, compress=False):
+            if post_data and url == '/repos/MrSenko/strazar/git/refs/heads/master':
+                return {
+                    "message": "Update is not a fast forward",
+                }
+            return _get_url_mock(url, post_data, compress)
+
+        _orig_get_url = strazar.get_url
+        strazar.get_url = mock.MagicMock(side_effect=_return_values)
+        os.environ['GITHUB_TOKEN'] = 'testing'
+        try:
+            with strazar.repository_snapshots() as snapshots:
+                ret = strazar.update_github(GITHUB_REPO='MrSenko/strazar',
+                                            GITHUB_BRANCH='master',
+                                            GITHUB_FILE='.travis.yml',
+                                            name='PyYAML', version='3.12')
+                self.assertEqual(ret, "Update is not a fast forward")
+                self.assertIsNone(snapshots.get(
+                    ('MrSenko/strazar', 'master', '.travis.yml')))
+        finally:
+            strazar.get_url = _orig_get_url
+            del os.environ['GITHUB_TOKEN']
+
 
     def test_update_github_travis_not_updated(self):
         """
@@ -251,7 +1151,7 @@ class StrazarPypiMonitorTestCase(unittest.TestCase):
         }
 
         _orig_get_url = strazar.get_url
-        strazar.get_url = mock.MagicMock(return_value="""
+        strazar.get_url = mock.MagicMock(return_value=io.BytesIO("""
 <?xml version="1.0" encoding="UTF-8"?>
 <!DOCTYPE rss PUBLIC "-//Netscape Communications//DTD RSS 0.91//EN" "http://my.netscape.com/publish/formats/rss-0.91.dtd">
 <rss version="0.91">
@@ -270,7 +1170,7 @@ class StrazarPypiMonitorTestCase(unittest.TestCase):
    </item>
   </channel>
 </rss>
-""".strip())
+""".strip().encode('UTF-8')))
         try:
             strazar.monitor_pypi_rss(config)
         finally:
@@ -307,7 +1207,7 @@ class StrazarPypiMonitorTestCase(unittest.TestCase):
         }
 
         _orig_get_url = strazar.get_url
-        strazar.get_url = mock.MagicMock(return_value="""
+        strazar.get_url = mock.MagicMock(return_value=io.BytesIO("""
 <?xml version="1.0" encoding="UTF-8"?>
 <!DOCTYPE rss PUBLIC "-//Netscape Communications//DTD RSS 0.91//EN" "http://my.netscape.com/publish/formats/rss-0.91.dtd">
 <rss version="0.91">
@@ -319,7 +1219,7 @@ class StrazarPypiMonitorTestCase(unittest.TestCase):
    </item>
   </channel>
 </rss>
-""".strip())
+""".strip().encode('UTF-8')))
         try:
             strazar.monitor_pypi_rss(config)
         finally:
@@ -369,7 +1269,7 @@ class StrazarPypiMonitorTestCase(unittest.TestCase):
         }
 
         _orig_get_url = strazar.get_url
-        strazar.get_url = mock.MagicMock(return_value="""
+        strazar.get_url = mock.MagicMock(return_value=io.BytesIO("""
 <?xml version="1.0" encoding="UTF-8"?>
 <!DOCTYPE rss PUBLIC "-//Netscape Communications//DTD RSS 0.91//EN" "http://my.netscape.com/publish/formats/rss-0.91.dtd">
 <rss version="0.91">
@@ -381,7 +1281,7 @@ class StrazarPypiMonitorTestCase(unittest.TestCase):
    </item>
   </channel>
 </rss>
-""".strip())
+""".strip().encode('UTF-8')))
         try:
             try:
                 strazar.monitor_pypi_rss(config)
@@ -423,7 +1323,7 @@ class StrazarPypiMonitorTestCase(unittest.TestCase):
         }
 
         _orig_get_url = strazar.get_url
-        strazar.get_url = mock.MagicMock(return_value="""
+        strazar.get_url = mock.MagicMock(return_value=io.BytesIO("""
 <?xml version="1.0" encoding="UTF-8"?>
 <!DOCTYPE rss PUBLIC "-//Netscape Communications//DTD RSS 0.91//EN" "http://my.netscape.com/publish/formats/rss-0.91.dtd">
 <rss version="0.91">
@@ -435,7 +1335,7 @@ class StrazarPypiMonitorTestCase(unittest.TestCase):
    </item>
   </channel>
 </rss>
-""".strip())
+""".strip().encode('UTF-8')))
         try:
             try:
                 strazar.monitor_pypi_rss(config)
@@ -458,7 +1358,7 @@ class StrazarPypiMonitorTestCase(unittest.TestCase):
         config = {}
 
         _orig_get_url = strazar.get_url
-        strazar.get_url = mock.MagicMock(return_value=u"""
+        strazar.get_url = mock.MagicMock(return_value=io.BytesIO(u"""
 <?xml version="1.0" encoding="UTF-8"?>
 <!DOCTYPE rss PUBLIC "-//Netscape Communications//DTD RSS 0.91//EN" "http://my.netscape.com/publish/formats/rss-0.91.dtd">
 <rss version="0.91">
@@ -703,19 +1603,770 @@ class StrazarPypiMonitorTestCase(unittest.TestCase):
     <pubDate>14 May 2016 23:50:25 GMT</pubDate>
    </item>
   <item>
-    <title>mdsplus-alpha 7.0.280</title>
-    <link>http://pypi.python.org/pypi/mdsplus-alpha/7.0.280</link>
-    <description>MDSplus Python Objects</description>
-    <pubDate>14 May 2016 23:49:47 GMT</pubDate>
-   </item>
-  </channel>
-</rss>
-""".strip())
+    <title>mdsplus-alpha 7.0.280</title>
+    <link>http://pypi.python.org/pypi/mdsplus-alpha/7.0.280</link>
+    <description>MDSplus Python Objects</description>
+    <pubDate>14 May 2016 23:49:47 GMT</pubDate>
+   </item>
+  </channel>
+</rss>
+""".strip().encode('UTF-8')))
+        try:
+            strazar.monitor_pypi_rss(config)
+        finally:
+            strazar.get_url = _orig_get_url
+        _test_callback.assert_not_called()
+
+
+    def test_parse_pypi_rss_yields_items(self):
+        """
+            WHEN parse_pypi_rss() reads a feed
+            THEN it yields (name, version, released_on) for every item
+            AND skips items which fail to parse
+        """
+        feed = io.BytesIO(b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="0.91">
+ <channel>
+  <title>PyPI Recent Updates</title>
+  <item>
+    <title>PyYAML 3.12</title>
+    <pubDate>12 May 2016 21:45:18 GMT</pubDate>
+  </item>
+  <item>
+    <title>broken</title>
+    <pubDate>12 May 2016 21:45:18 GMT</pubDate>
+  </item>
+  <item>
+    <title>Django 1.10</title>
+    <pubDate>12 May 2016 21:40:00 GMT</pubDate>
+  </item>
+ </channel>
+</rss>""")
+        items = list(strazar.parse_pypi_rss(feed))
+        self.assertEqual(items, [
+            ('PyYAML', '3.12', datetime(2016, 5, 12, 21, 45, 18)),
+            ('Django', '1.10', datetime(2016, 5, 12, 21, 40, 0)),
+        ])
+
+    def test_monitor_pypi_rss_from_feed_file(self):
+        """
+            WHEN monitor_pypi_rss() is given a feed file
+            THEN it doesn't fetch the feed from PyPI
+            AND executes the callbacks for packages in the file
+        """
+        _test_callback = mock.MagicMock()
+        config = {
+            "PyYAML" : [
+                {
+                    'cb' : _test_callback,
+                    'args': {},
+                },
+            ],
+        }
+        feed = io.BytesIO(b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="0.91">
+ <channel>
+  <item>
+    <title>PyYAML 3.12</title>
+    <pubDate>12 May 2016 21:45:18 GMT</pubDate>
+  </item>
+ </channel>
+</rss>""")
+
+        _orig_get_url = strazar.get_url
+        strazar.get_url = mock.MagicMock(side_effect=Exception('Boom!'))
+        try:
+            strazar.monitor_pypi_rss(config, feed=feed)
+        finally:
+            strazar.get_url = _orig_get_url
+
+        _test_callback.assert_called_once_with(
+            name='PyYAML', version='3.12',
+            released_on=datetime(2016, 5, 12, 21, 45, 18))
+
+    def test_monitor_pypi_rss_state_file_skips_seen_items(self):
+        """
+            GIVEN a state file from a previous run
+            WHEN monitor_pypi_rss() is executed again
+            THEN only items newer than the recorded one are processed
+        """
+        item = """
+  <item>
+    <title>%s</title>
+    <pubDate>%s</pubDate>
+  </item>"""
+        feed = """<?xml version="1.0" encoding="UTF-8"?>
+<rss version="0.91">
+ <channel>%s
+ </channel>
+</rss>"""
+        old_items = (item % ('PyYAML 3.12', '12 May 2016 21:45:18 GMT') +
+                     item % ('Django 1.10', '12 May 2016 21:40:00 GMT'))
+        new_item = item % ('Django 1.11', '13 May 2016 10:00:00 GMT')
+
+        _test_callback = mock.MagicMock()
+        config = {
+            'PyYAML': [{'cb': _test_callback, 'args': {}}],
+            'Django': [{'cb': _test_callback, 'args': {}}],
+        }
+        state_dir = tempfile.mkdtemp()
+        state_file = os.path.join(state_dir, 'cursor.json')
+        try:
+            strazar.monitor_pypi_rss(
+                config, io.BytesIO((feed % old_items).encode('UTF-8')),
+                state_file)
+            self.assertEqual(_test_callback.call_count, 2)
+
+            _test_callback.reset_mock()
+            strazar.monitor_pypi_rss(
+                config,
+                io.BytesIO((feed % (new_item + old_items)).encode('UTF-8')),
+                state_file)
+            _test_callback.assert_called_once_with(
+                name='Django', version='1.11',
+                released_on=datetime(2016, 5, 13, 10, 0, 0))
+
+            with open(state_file) as cursor_file:
+                self.assertEqual(json.load(cursor_file), {
+                    'pub_date': '13 May 2016 10:00:00 GMT',
+                    'title': 'Django 1.11',
+                })
+        finally:
+            shutil.rmtree(state_dir)
+
+    def test_monitor_pypi_rss_state_file_retries_failed_items(self):
+        """
+            GIVEN callbacks failed for some releases
+            WHEN monitor_pypi_rss() is executed again
+            THEN the failed releases are processed again
+            AND the cursor only moves past successful releases
+        """
+        def _callback(**kwargs):
+            if kwargs['version'] in failing:
+                raise RuntimeError('transient 502')
+            return True
+
+        _test_callback = mock.MagicMock(side_effect=_callback)
+        config = {'PyYAML': [{'cb': _test_callback, 'args': {}}]}
+        feed = """<?xml version="1.0" encoding="UTF-8"?>
+<rss version="0.91">
+ <channel>
+  <item>
+    <title>PyYAML 3.13</title>
+    <pubDate>13 May 2016 10:00:00 GMT</pubDate>
+  </item>
+  <item>
+    <title>PyYAML 3.12</title>
+    <pubDate>12 May 2016 21:45:18 GMT</pubDate>
+  </item>
+  <item>
+    <title>PyYAML 3.11</title>
+    <pubDate>12 May 2016 20:00:00 GMT</pubDate>
+  </item>
+ </channel>
+</rss>"""
+
+        state_dir = tempfile.mkdtemp()
+        state_file = os.path.join(state_dir, 'cursor.json')
+        try:
+            failing = ['3.13', '3.12']
+            strazar.monitor_pypi_rss(config, io.BytesIO(feed.encode('UTF-8')),
+                                     state_file)
+            with open(state_file) as cursor_file:
+                self.assertEqual(json.load(cursor_file), {
+                    'pub_date': '12 May 2016 21:45:18 GMT',
+                    'title': '',
+                })
+
+            failing = []
+            _test_callback.reset_mock()
+            strazar.monitor_pypi_rss(config, io.BytesIO(feed.encode('UTF-8')),
+                                     state_file)
+            self.assertEqual(
+                [c[1]['version'] for c in _test_callback.call_args_list],
+                ['3.13', '3.12'])
+            with open(state_file) as cursor_file:
+                self.assertEqual(json.load(cursor_file)['title'],
+                                 'PyYAML 3.13')
+        finally:
+            shutil.rmtree(state_dir)
+
+    def test_monitor_pypi_rss_with_workers(self):
+        """
+            WHEN callbacks are executed in a thread pool
+            THEN callbacks for different repositories run in parallel
+            AND callbacks for the same repository are serialized
+            AND the result of every callback is reported
+        """
+        lock = threading.Lock()
+        running = {}
+        max_running = {}
+
+        def _callback(**kwargs):
+            repo = kwargs['GITHUB_REPO']
+            with lock:
+                running[repo] = running.get(repo, 0) + 1
+                running['total'] = running.get('total', 0) + 1
+                for key in (repo, 'total'):
+                    max_running[key] = max(max_running.get(key, 0),
+                                           running[key])
+            time.sleep(0.05)
+            with lock:
+                running[repo] -= 1
+                running['total'] -= 1
+            if kwargs['name'] == 'Django':
+                raise RuntimeError('Boom!')
+            return True
+
+        config = {}
+        for package in ('PyYAML', 'Django'):
+            config[package] = [
+                {'cb': _callback, 'args': {'GITHUB_REPO': 'repo1',
+                                           'GITHUB_BRANCH': 'master'}},
+                {'cb': _callback, 'args': {'GITHUB_REPO': 'repo2',
+                                           'GITHUB_BRANCH': 'master'}},
+            ]
+        feed = io.BytesIO(b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="0.91">
+ <channel>
+  <item>
+    <title>PyYAML 3.12</title>
+    <pubDate>12 May 2016 21:45:18 GMT</pubDate>
+  </item>
+  <item>
+    <title>Django 1.10</title>
+    <pubDate>12 May 2016 21:40:00 GMT</pubDate>
+  </item>
+ </channel>
+</rss>""")
+        results = strazar.monitor_pypi_rss(config, feed=feed, workers=4)
+
+        self.assertEqual(len(results), 4)
+        self.assertEqual([r['result'] for r in results],
+                         [True, True, None, None])
+        self.assertEqual([str(r['error']) for r in results[2:]],
+                         ['Boom!', 'Boom!'])
+        self.assertEqual(max_running['repo1'], 1)
+        self.assertEqual(max_running['repo2'], 1)
+        self.assertEqual(max_running['total'], 2)
+
+    def test_monitor_pypi_rss_batch(self):
+        """
+            WHEN several monitored packages are released
+            AND batch mode is enabled
+            THEN the callback is executed once per target file
+                with all updates in chronological order
+        """
+        _test_callback = mock.MagicMock(return_value=True)
+        target = {
+            'GITHUB_REPO' : 'MrSenko/strazar',
+            'GITHUB_BRANCH' : 'master',
+            'GITHUB_FILE' : '.travis.yml'
+        }
+        other_target = dict(target, GITHUB_REPO='MrSenko/other')
+        config = {
+            'PyYAML': [{'cb': _test_callback, 'args': target}],
+            'PyGithub': [{'cb': _test_callback, 'args': target},
+                         {'cb': _test_callback, 'args': other_target}],
+        }
+        feed = io.BytesIO(b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="0.91">
+ <channel>
+  <item>
+    <title>PyYAML 3.12</title>
+    <pubDate>12 May 2016 21:45:18 GMT</pubDate>
+  </item>
+  <item>
+    <title>PyGithub 1.27.1</title>
+    <pubDate>12 May 2016 21:40:00 GMT</pubDate>
+  </item>
+ </channel>
+</rss>""")
+        results = strazar.monitor_pypi_rss(config, feed=feed, batch=True)
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(_test_callback.call_args_list, [
+            mock.call(updates=[('PyGithub', '1.27.1'), ('PyYAML', '3.12')],
+                      **target),
+            mock.call(updates=[('PyGithub', '1.27.1')], **other_target),
+        ])
+
+
+    def test_monitor_pypi_rss_batch_keeps_per_package_options(self):
+        """
+            GIVEN two packages target the same file with different options
+            WHEN they are released
+            AND batch mode is enabled
+            THEN each set of options gets its own batch
+        """
+        _test_callback = mock.MagicMock(return_value=True)
+        target = {
+            'GITHUB_REPO' : 'MrSenko/strazar',
+            'GITHUB_BRANCH' : 'master',
+            'GITHUB_FILE' : '.travis.yml'
+        }
+        incremental = dict(target, incremental=True)
+        config = {
+            'PyYAML': [{'cb': _test_callback, 'args': target}],
+            'PyGithub': [{'cb': _test_callback, 'args': incremental}],
+            'Django': [{'cb': _test_callback, 'args': dict(incremental)}],
+        }
+        feed = io.BytesIO(b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="0.91">
+ <channel>
+  <item>
+    <title>PyYAML 3.12</title>
+    <pubDate>12 May 2016 21:45:18 GMT</pubDate>
+  </item>
+  <item>
+    <title>PyGithub 1.27.1</title>
+    <pubDate>12 May 2016 21:40:00 GMT</pubDate>
+  </item>
+  <item>
+    <title>Django 1.10</title>
+    <pubDate>12 May 2016 21:30:00 GMT</pubDate>
+  </item>
+ </channel>
+</rss>""")
+        results = strazar.monitor_pypi_rss(config, feed=feed, batch=True)
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(_test_callback.call_args_list, [
+            mock.call(updates=[('PyYAML', '3.12')], **target),
+            mock.call(updates=[('Django', '1.10'), ('PyGithub', '1.27.1')],
+                      **incremental),
+        ])
+
+class StrazarMetricsTestCase(unittest.TestCase):
+    """
+        Tests for the metrics registry
+    """
+    def setUp(self):
+        strazar.metrics.reset()
+
+    def tearDown(self):
+        strazar.metrics.reset()
+
+    def test_export_prometheus_and_json(self):
+        """
+            WHEN counters and histograms are recorded
+            THEN they are exported in the Prometheus text format
+            AND as JSON
+        """
+        metrics = strazar.Metrics()
+        metrics.inc('requests_total', host='pypi.org', method='GET')
+        metrics.inc('requests_total', 2, host='pypi.org', method='GET')
+        metrics.observe('duration_seconds', 0.3, buckets=(0.1, 1))
+
+        self.assertEqual(metrics.to_prometheus(), """\
+# TYPE requests_total counter
+requests_total{host="pypi.org",method="GET"} 3
+# TYPE duration_seconds histogram
+duration_seconds_bucket{le="0.1"} 0
+duration_seconds_bucket{le="1"} 1
+duration_seconds_bucket{le="+Inf"} 1
+duration_seconds_sum 0.3
+duration_seconds_count 1
+""")
+
+        data = json.loads(metrics.to_json())
+        self.assertEqual(data['counters'], [{
+            'name': 'requests_total',
+            'labels': {'host': 'pypi.org', 'method': 'GET'},
+            'value': 3,
+        }])
+        self.assertEqual(data['histograms'][0]['count'], 1)
+
+        tmp_dir = tempfile.mkdtemp()
         try:
-            strazar.monitor_pypi_rss(config)
+            metrics.write(os.path.join(tmp_dir, 'strazar.prom'))
+            metrics.write(os.path.join(tmp_dir, 'strazar.json'))
+            self.assertEqual(sorted(os.listdir(tmp_dir)),
+                             ['strazar.json', 'strazar.prom'])
+            with open(os.path.join(tmp_dir, 'strazar.json')) as json_file:
+                self.assertEqual(json.load(json_file), data)
         finally:
-            strazar.get_url = _orig_get_url
+            shutil.rmtree(tmp_dir)
+
+    def test_get_url_records_requests(self):
+        """
+            WHEN get_url() is called
+            THEN requests and bytes are counted per host
+        """
+        server = _LocalServer()
+        with server as httpd:
+            httpd.responses['/data'] = (200, {}, {'answer': 42})
+            strazar.get_url(server.url + '/data')
+            strazar.get_url(server.url + '/data', {'question': None})
+
+        host = server.url[len('http://'):]
+        metrics = strazar.metrics
+        self.assertEqual(metrics.counter('strazar_http_requests_total',
+                                         host=host, method='GET'), 1)
+        self.assertEqual(metrics.counter('strazar_http_requests_total',
+                                         host=host, method='POST'), 1)
+        self.assertEqual(metrics.counter('strazar_http_received_bytes_total',
+                                         host=host), 2 * len(b'{"answer": 42}'))
+        self.assertEqual(metrics.counter('strazar_http_sent_bytes_total',
+                                         host=host), len(b'{"question": null}'))
+        self.assertIn(
+            'strazar_http_request_duration_seconds_count{host="%s"} 2' % host,
+            metrics.to_prometheus())
+
+    def test_monitor_pypi_rss_records_feed_and_callbacks(self):
+        """
+            WHEN monitor_pypi_rss() processes a feed
+            THEN scanned and matched items are counted
+            AND failed callbacks are counted by name
+        """
+        def failing_callback(**kwargs):
+            raise Exception('Boom!')
+
+        config = {
+            "PyYAML" : [
+                {
+                    'cb' : failing_callback,
+                    'args': {},
+                },
+            ],
+        }
+        feed = io.BytesIO(b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="0.91">
+ <channel>
+  <item>
+    <title>PyYAML 3.12</title>
+    <pubDate>12 May 2016 21:45:18 GMT</pubDate>
+  </item>
+  <item>
+    <title>Django 1.10</title>
+    <pubDate>12 May 2016 21:40:00 GMT</pubDate>
+  </item>
+ </channel>
+</rss>""")
+        strazar.monitor_pypi_rss(config, feed=feed)
+
+        metrics = strazar.metrics
+        self.assertEqual(metrics.counter('strazar_feed_items_scanned_total'),
+                         2)
+        self.assertEqual(metrics.counter('strazar_feed_items_matched_total'),
+                         1)
+        self.assertEqual(metrics.counter('strazar_callback_failures_total',
+                                         callback='failing_callback'), 1)
+
+    def test_update_travis_records_matrix_rows(self):
+        """
+            WHEN update_travis() adds a new version
+            THEN the matrix size before and after is recorded
+        """
+        old_travis = {'env': ['_DJANGO=1.9 _BOTO=2.45.0']}
+        strazar.update_travis(old_travis, 'Django', '1.10')
+
+        text = strazar.metrics.to_prometheus()
+        self.assertIn('strazar_matrix_rows_before_sum 1\n', text)
+        self.assertIn('strazar_matrix_rows_after_sum 2\n', text)
+
+
+class _PyPIRequestHandler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ('/pypi',)
+
+
+class _LocalPyPI(object):
+    """
+        Stand-in for the PyPI XML-RPC changelog API serving @events,
+        a list of (name, version, timestamp, action, serial) tuples.
+    """
+    def __init__(self, events):
+        self.events = events
+        self.calls = []
+        self.server = SimpleXMLRPCServer(('127.0.0.1', 0),
+                                         requestHandler=_PyPIRequestHandler,
+                                         logRequests=False, allow_none=True)
+        self.server.register_function(self.changelog_last_serial)
+        self.server.register_function(self.changelog_since_serial)
+        self.url = 'http://127.0.0.1:%d/pypi' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def changelog_last_serial(self):
+        self.calls.append(('changelog_last_serial',))
+        return self.events[-1][4]
+
+    def changelog_since_serial(self, serial):
+        self.calls.append(('changelog_since_serial', serial))
+        return [event for event in self.events if event[4] > serial]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StrazarPypiChangelogTestCase(unittest.TestCase):
+    """
+        Tests for monitor_pypi_changelog()
+    """
+    events = [
+        ['PyYAML', '3.12', 1463089518, 'new release', 100],
+        ['PyYAML', '3.12', 1463089520, 'add source file PyYAML-3.12.tar.gz', 101],
+        ['Django', None, 1463089530, 'create', 102],
+        ['Django', '1.10', 1463089540, 'new release', 103],
+        ['fleece', '0.4.0', 1463089550, 'new release', 104],
+    ]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.tmp_dir, 'serial.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_first_run_records_serial_only(self):
+        """
+            GIVEN there's no previous state
+            WHEN monitor_pypi_changelog() is executed
+            THEN no callbacks are executed
+            AND the current serial is recorded
+        """
+        _test_callback = mock.MagicMock()
+        config = {'PyYAML': [{'cb': _test_callback, 'args': {}}]}
+
+        with _LocalPyPI(self.events) as pypi:
+            results = strazar.monitor_pypi_changelog(
+                config, state_file=self.state_file, url=pypi.url)
+
+        self.assertEqual(results, [])
+        self.assertEqual(pypi.calls, [('changelog_last_serial',)])
         _test_callback.assert_not_called()
+        with open(self.state_file) as f:
+            self.assertEqual(json.load(f), {'serial': 104})
+
+    def test_new_releases_since_serial(self):
+        """
+            GIVEN the serial of a previous run
+            WHEN monitor_pypi_changelog() is executed
+            THEN only newer events are fetched
+            AND callbacks are executed for new releases in config
+            AND the serial of the last event is recorded
+        """
+        _test_callback = mock.MagicMock()
+        config = {
+            'pyyaml': [{'cb': _test_callback, 'args': {}}],
+            'Django': [{'cb': _test_callback, 'args': {}}],
+        }
+        with open(self.state_file, 'w') as f:
+            json.dump({'serial': 100}, f)
+
+        with _LocalPyPI(self.events) as pypi:
+            results = strazar.monitor_pypi_changelog(
+                config, state_file=self.state_file, url=pypi.url)
+
+        self.assertEqual(pypi.calls, [('changelog_since_serial', 100)])
+        self.assertEqual(len(results), 1)
+        _test_callback.assert_called_once_with(
+            name='Django', version='1.10',
+            released_on=datetime(2016, 5, 12, 21, 45, 40))
+        with open(self.state_file) as f:
+            self.assertEqual(json.load(f), {'serial': 104})
+
+    def test_batch_keeps_chronological_order(self):
+        """
+            WHEN releases are batched
+            THEN updates are listed oldest first
+        """
+        _test_callback = mock.MagicMock()
+        config = {'*': [{'cb': _test_callback, 'args': {}}]}
+
+        with _LocalPyPI(self.events) as pypi:
+            strazar.monitor_pypi_changelog(config, serial=0, batch=True,
+                                           url=pypi.url)
+
+        _test_callback.assert_called_once_with(updates=[
+            ('PyYAML', '3.12'), ('Django', '1.10'), ('fleece', '0.4.0'),
+        ])
+
+
+    def test_failed_release_is_read_again(self):
+        """
+            GIVEN a callback fails for a release
+            WHEN monitor_pypi_changelog() is executed again
+            THEN the failed release and all newer ones are processed again
+        """
+        versions = []
+
+        def _callback(**kwargs):
+            versions.append(kwargs['version'])
+            if kwargs['name'] == 'Django' and len(versions) == 2:
+                raise RuntimeError('transient 502')
+            return True
+
+        config = {'*': [{'cb': _callback, 'args': {}}]}
+        with open(self.state_file, 'w') as f:
+            json.dump({'serial': 99}, f)
+
+        with _LocalPyPI(self.events) as pypi:
+            strazar.monitor_pypi_changelog(
+                config, state_file=self.state_file, url=pypi.url)
+            with open(self.state_file) as f:
+                self.assertEqual(json.load(f), {'serial': 102})
+
+            strazar.monitor_pypi_changelog(
+                config, state_file=self.state_file, url=pypi.url)
+
+        self.assertEqual(versions, ['3.12', '1.10', '0.4.0', '1.10', '0.4.0'])
+        with open(self.state_file) as f:
+            self.assertEqual(json.load(f), {'serial': 104})
+
+    def test_stalled_server_times_out(self):
+        """
+            GIVEN PyPI accepts the connection but never answers
+            WHEN pypi_changelog() is called with a timeout
+            THEN it gives up instead of blocking forever
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        try:
+            url = 'http://127.0.0.1:%d/pypi' % server.getsockname()[1]
+            with self.assertRaises(socket.timeout):
+                strazar.pypi_changelog(0, url, timeout=0.1)
+        finally:
+            server.close()
+
+class StrazarDaemonTestCase(unittest.TestCase):
+    """
+        Tests for Daemon
+    """
+    def test_polls_until_stopped(self):
+        """
+            WHEN the daemon is running
+            THEN it polls repeatedly with the given arguments
+            AND errors don't stop it
+        """
+        calls = []
+
+        def _monitor(config, **kwargs):
+            calls.append((config, kwargs))
+            if len(calls) == 2:
+                raise Exception('Boom!')
+            if len(calls) == 3:
+                daemon.stop()
+            return []
+
+        config = {'PyYAML': []}
+        daemon = strazar.Daemon(config, interval=0, monitor=_monitor,
+                                state_file='/tmp/state.json')
+        self.assertEqual(daemon.run(handle_signals=False), 3)
+        self.assertEqual(calls, [(config, {'state_file': '/tmp/state.json'})] * 3)
+
+    def test_next_delay_has_jitter(self):
+        """
+            WHEN the next poll is scheduled
+            THEN the interval is randomized within the jitter
+        """
+        daemon = strazar.Daemon({}, interval=100, jitter=0.2)
+        delays = [daemon.next_delay() for _ in range(100)]
+        self.assertTrue(all(80 <= delay <= 120 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_sigterm_lets_poll_finish(self):
+        """
+            WHEN SIGTERM is received during a poll
+            THEN the poll finishes
+            AND the daemon stops without waiting for the next one
+        """
+        finished = []
+
+        def _monitor(_config, **_kwargs):
+            os.kill(os.getpid(), signal.SIGTERM)
+            time.sleep(0.01)
+            finished.append(True)
+            return []
+
+        tmp_dir = tempfile.mkdtemp()
+        metrics_file = os.path.join(tmp_dir, 'strazar.prom')
+        _orig_handler = signal.getsignal(signal.SIGTERM)
+        try:
+            daemon = strazar.Daemon({}, interval=3600, monitor=_monitor,
+                                    metrics_file=metrics_file)
+            self.assertEqual(daemon.run(), 1)
+            self.assertEqual(finished, [True])
+            self.assertTrue(os.path.exists(metrics_file))
+            self.assertEqual(signal.getsignal(signal.SIGTERM), _orig_handler)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+    def test_changelog_serial_is_kept_between_polls(self):
+        """
+            GIVEN the daemon monitors the changelog without a state file
+            WHEN a package is released between two polls
+            THEN the second poll executes its callback
+        """
+        _test_callback = mock.MagicMock()
+        config = {'*': [{'cb': _test_callback, 'args': {}}]}
+        polls = []
+
+        def _monitor(config, **kwargs):
+            polls.append(strazar.monitor_pypi_changelog(config, **kwargs))
+            if len(polls) == 1:
+                pypi.events.append(
+                    ['Django', '1.11', 1463089560, 'new release', 105])
+            else:
+                daemon.stop()
+            return polls[-1]
+
+        events = [['PyYAML', '3.12', 1463089518, 'new release', 100]]
+        with _LocalPyPI(events) as pypi:
+            daemon = strazar.Daemon(config, interval=0, monitor=_monitor,
+                                    url=pypi.url)
+            self.assertEqual(daemon.run(handle_signals=False), 2)
+
+        self.assertEqual(pypi.calls, [('changelog_last_serial',),
+                                      ('changelog_since_serial', 100)])
+        _test_callback.assert_called_once_with(
+            name='Django', version='1.11',
+            released_on=datetime(2016, 5, 12, 21, 46))
+        self.assertEqual(daemon.monitor_args, {'url': pypi.url})
+
+class StrazarPackageMatcherTestCase(unittest.TestCase):
+    """
+        Tests for PackageMatcher
+    """
+
+    def test_names_are_normalized(self):
+        """
+            WHEN config lists the same package under different spellings
+            THEN all spellings share the callbacks
+            AND identical callbacks are executed only once
+        """
+        cfg = {'cb': None, 'args': {'GITHUB_REPO': 'MrSenko/strazar'}}
+        other_cfg = {'cb': None, 'args': {'GITHUB_REPO': 'MrSenko/other'}}
+        matcher = strazar.PackageMatcher({
+            'PyYAML': [cfg],
+            'pyyaml': [dict(cfg), other_cfg],
+        })
+        self.assertEqual(matcher.match('PyYAML'), [cfg, other_cfg])
+        self.assertEqual(matcher.match('PYYAML'), [cfg, other_cfg])
+        self.assertEqual(matcher.match('Py-YAML'), [])
+
+    def test_glob_patterns(self):
+        """
+            WHEN config contains a glob pattern
+            THEN matching packages execute the pattern callbacks
+                in addition to the exact ones
+        """
+        exact = {'cb': None, 'args': {'GITHUB_REPO': 'exact'}}
+        pattern = {'cb': None, 'args': {'GITHUB_REPO': 'pattern'}}
+        matcher = strazar.PackageMatcher({
+            'django_storages': [exact],
+            'django-*': [pattern],
+        })
+        self.assertEqual(matcher.match('django.storages'), [exact, pattern])
+        self.assertEqual(matcher.match('Django-Braces'), [pattern])
+        self.assertEqual(matcher.match('Django'), [])
 
 
 class StrazarTravisTestCase(unittest.TestCase):
@@ -727,7 +2378,7 @@ class StrazarTravisTestCase(unittest.TestCase):
             WHEN new package version is already present in environment
             THEN it is not included twice
         """
-        old_travis = yaml.load("""
+        old_travis = yaml.safe_load("""
 language: python
 env:
   - _PYYAML=3.11
@@ -743,7 +2394,7 @@ env:
             WHEN new package version is not present in environment
             THEN it is included
         """
-        old_travis = yaml.load("""
+        old_travis = yaml.safe_load("""
 language: python
 env:
   - _PYYAML=3.11
@@ -759,7 +2410,7 @@ env:
             WHEN there are 2 older versions in environment
             THEN the new one is included as well
         """
-        old_travis = yaml.load("""
+        old_travis = yaml.safe_load("""
 language: python
 env:
   - _PYYAML=3.11
@@ -779,7 +2430,7 @@ env:
             THEN the resulting ENV includes entries with only the new version
                 of existing package updated
         """
-        old_travis = yaml.load("""
+        old_travis = yaml.safe_load("""
 language: python
 env:
   - _DJANGO=1.9 _BOTO=2.45.0
@@ -861,13 +2512,88 @@ env:
         self.assertTrue('A=2 B=4 C=5' in new_env)
         self.assertTrue('A=2 B=4 C=6' in new_env)
 
+    def test_iter_travis_env_is_lazy_and_sorted(self):
+        """
+            WHEN iter_travis_env() expands several groups
+            THEN lines are yielded one by one
+            AND in the same order as a sorted list of all combinations
+        """
+        env_vars = {
+            ('A', 'B'): {
+                'A': set(['1', '1.0', '10', '2']),
+                'B': set([3, 30, 4]),
+            },
+            ('A', 'C'): {
+                'A': set(['1', '1.0', '10', '2']),
+                'C': set(['0.9', '0.10']),
+            },
+        }
+        lines = strazar.iter_travis_env(env_vars)
+        self.assertFalse(isinstance(lines, list))
+
+        expected = []
+        for pkgs in env_vars:
+            keys = sorted(pkgs)
+            for p in itertools.product(*[env_vars[pkgs][k] for k in keys]):
+                expected.append(' '.join(['%s=%s' % kv for kv in zip(keys, p)]))
+        self.assertEqual(list(lines), sorted(expected))
+
+    def test_covering_array_covers_all_pairs(self):
+        """
+            WHEN a pairwise covering array is built
+            THEN every pair of values from any two pools appears in a row
+            AND there are far fewer rows than in the full product
+        """
+        pools = [['a%d' % i for i in range(3)],
+                 ['b%d' % i for i in range(3)],
+                 ['c%d' % i for i in range(2)],
+                 ['d%d' % i for i in range(3)],
+                 ['e%d' % i for i in range(2)]]
+        rows = strazar.covering_array(pools, 2)
+
+        for i, j in itertools.combinations(range(len(pools)), 2):
+            pairs = set((row[i], row[j]) for row in rows)
+            self.assertEqual(pairs, set(itertools.product(pools[i], pools[j])))
+        self.assertTrue(len(rows) < 20)
+
+    def test_covering_array_rejects_strength_below_one(self):
+        """
+            WHEN a covering array of strength 0 is requested
+            THEN ValueError is raised instead of dropping versions
+        """
+        with self.assertRaises(ValueError):
+            strazar.covering_array([['a0', 'a1'], ['b0', 'b1']], 0)
+
+    def test_update_travis_pairwise(self):
+        """
+            WHEN update_travis() is called with strength=2
+            THEN the new version appears in the matrix
+            AND the matrix is smaller than the full product
+        """
+        old_travis = yaml.safe_load("""
+env:
+- _A=1 _B=1 _C=1 _DJANGO=1.8
+- _A=2 _B=2 _C=2 _DJANGO=1.9
+""")
+        new_travis = strazar.update_travis(old_travis, 'Django', '1.10',
+                                           strength=2)
+        self.assertTrue(len(new_travis['env']) < 2 * 2 * 2 * 3)
+        self.assertTrue([line for line in new_travis['env']
+                         if '_DJANGO=1.10' in line])
+        self.assertEqual(new_travis['env'], sorted(new_travis['env']))
+
+        # full product when strength covers all variables
+        new_travis = strazar.update_travis(old_travis, 'Django', '1.10',
+                                           strength=4)
+        self.assertEqual(len(new_travis['env']), 2 * 2 * 2 * 3)
+
     def test_dont_update_travis_when_new_version_for_another_package(self):
         """
             WHEN there is a new version for a package
             AND package IS NOT included in yaml
             THEN .travis.yml should not change
         """
-        old_travis = yaml.load("""
+        old_travis = yaml.safe_load("""
 env:
 - _PYYAML=3.11
 language: python
@@ -881,7 +2607,7 @@ language: python
             WHEN there is no new version
             THEN .travis.yml should not change
         """
-        old_travis = yaml.load("""
+        old_travis = yaml.safe_load("""
 env:
 - _PYYAML=3.11
 language: python
@@ -896,7 +2622,7 @@ language: python
             BUT the input file is not sorted
             THEN .travis.yml should change
         """
-        old_travis = yaml.load("""
+        old_travis = yaml.safe_load("""
 env:
   - _PYYAML=3.11 _PYGITHUB=1.26.0
 """)
@@ -912,12 +2638,12 @@ env:
             THEN .travis.yml should change accordingly
         """
 
-        old_travis = yaml.load("""
+        old_travis = yaml.safe_load("""
 env:
 - _PYYAML=3.11
 language: python
 """)
-        expected_travis = yaml.load("""
+        expected_travis = yaml.safe_load("""
 env:
 - _PYYAML=3.11
 - _PYYAML=3.12
@@ -933,12 +2659,12 @@ language: python
             THEN .travis.yml should change accordingly
         """
 
-        old_travis = yaml.load("""
+        old_travis = yaml.safe_load("""
 env:
 - _JINJA_AB=0.3.0 _PYYAML=3.11
 language: python
 """)
-        expected_travis = yaml.load("""
+        expected_travis = yaml.safe_load("""
 env:
 - _JINJA_AB=0.3.0 _PYYAML=3.11
 - _JINJA_AB=0.3.0 _PYYAML=3.12
@@ -946,3 +2672,342 @@ language: python
 """)
         new_travis = strazar.update_travis(old_travis, 'PyYAML', '3.12')
         self.assertEqual(new_travis, expected_travis)
+
+    def test_update_travis_incremental_only_adds_new_rows(self):
+        """
+            WHEN a new version is found
+            AND incremental update is requested
+            THEN only rows with the new version are added after each group
+            AND existing rows keep their order
+        """
+        old_travis = yaml.safe_load("""
+env:
+- _DJANGO=1.9 _BOTO=2.45.0
+- _DJANGO=1.8 _BOTO=2.45.0
+- _BOTO3=1.4.3 _DJANGO=1.9
+- _PYYAML=3.11
+language: python
+""")
+        new_travis = strazar.update_travis(old_travis, 'Django', '1.10',
+                                           incremental=True)
+        self.assertEqual(new_travis['env'], [
+            '_DJANGO=1.9 _BOTO=2.45.0',
+            '_DJANGO=1.8 _BOTO=2.45.0',
+            '_DJANGO=1.10 _BOTO=2.45.0',
+            '_BOTO3=1.4.3 _DJANGO=1.9',
+            '_BOTO3=1.4.3 _DJANGO=1.10',
+            '_PYYAML=3.11',
+        ])
+        self.assertEqual(new_travis['language'], 'python')
+        # the input is not modified
+        self.assertEqual(len(old_travis['env']), 4)
+
+    def test_update_travis_incremental_no_new_version(self):
+        """
+            WHEN the version is already listed or the package isn't used
+            AND incremental update is requested
+            THEN .travis.yml doesn't change, even if it isn't sorted
+        """
+        old_travis = yaml.safe_load("""
+env:
+  - _PYYAML=3.11 _PYGITHUB=1.26.0
+""")
+        self.assertEqual(strazar.update_travis(old_travis, 'PyYAML', '3.11',
+                                               incremental=True), old_travis)
+        self.assertEqual(strazar.update_travis(old_travis, 'Django', '1.10',
+                                               incremental=True), old_travis)
+
+    def test_retained_versions(self):
+        """
+            WHEN a retention policy is applied
+            THEN versions are ordered according to PEP 440
+        """
+        versions = set(['1.8', '1.8.1', '1.9', '1.10', '1.10.1', '1.11rc1',
+                        'not-a-version'])
+        self.assertEqual(strazar.retained_versions(versions, {'keep': 2}),
+                         set(['1.11rc1', '1.10.1', 'not-a-version']))
+        self.assertEqual(strazar.retained_versions(versions,
+                                                   {'latest_patch': True}),
+                         set(['1.8.1', '1.9', '1.10.1', '1.11rc1',
+                              'not-a-version']))
+        self.assertEqual(strazar.retained_versions(versions,
+                                                   {'latest_patch': True,
+                                                    'keep': 2}),
+                         set(['1.10.1', '1.11rc1', 'not-a-version']))
+
+    def test_update_travis_with_retention(self):
+        """
+            WHEN a new version is found
+            AND only the newest 2 versions are retained
+            THEN the oldest version is dropped from the matrix
+        """
+        old_travis = yaml.safe_load("""
+env:
+- _DJANGO=1.9 _PYYAML=3.11
+- _DJANGO=1.10 _PYYAML=3.11
+""")
+        retention = {'Django': {'keep': 2}}
+        new_travis = strazar.update_travis(old_travis, 'Django', '1.11',
+                                           retention=retention)
+        self.assertEqual(new_travis['env'], [
+            '_DJANGO=1.10 _PYYAML=3.11',
+            '_DJANGO=1.11 _PYYAML=3.11',
+        ])
+
+        new_travis = strazar.update_travis(old_travis, 'Django', '1.11',
+                                           incremental=True,
+                                           retention=retention)
+        self.assertEqual(new_travis['env'], [
+            '_DJANGO=1.10 _PYYAML=3.11',
+            '_DJANGO=1.11 _PYYAML=3.11',
+        ])
+
+        # an old release is not added at all
+        new_travis = strazar.update_travis(old_travis, 'Django', '1.8',
+                                           incremental=True,
+                                           retention=retention)
+        self.assertEqual(new_travis, old_travis)
+
+
+class StrazarYamlTestCase(unittest.TestCase):
+    """
+        Tests for the YAML loader and dumper selection
+    """
+
+    @unittest.skipUnless(yaml.__with_libyaml__, 'PyYAML built without libyaml')
+    def test_libyaml_is_used_when_available(self):
+        """
+            WHEN PyYAML was built with libyaml
+            THEN the C loader and dumper are used
+            AND they produce the same output as the pure Python ones
+        """
+        self.assertEqual(strazar.load_yaml('env: []'), {'env': []})
+        self.assertIs(strazar.travis.YamlLoader, yaml.CSafeLoader)
+        self.assertIs(strazar.travis.YamlDumper, yaml.CSafeDumper)
+
+        travis = {
+            'language': 'python',
+            'python': ['2.7', '3.5'],
+            'install': ['pip install PyYAML==$_PYYAML Django==$_DJANGO'],
+            'env': ['_DJANGO=1.%d _PYYAML=3.%d' % (i, j)
+                    for i in range(20) for j in range(20)],
+            'matrix': {'allow_failures': [{'env': '_DJANGO=1.%d' % i}
+                                          for i in range(20)]},
+        }
+        c_output = yaml.dump(travis, Dumper=yaml.CSafeDumper,
+                             default_flow_style=False)
+        py_output = yaml.dump(travis, Dumper=yaml.SafeDumper,
+                              default_flow_style=False)
+        self.assertEqual(c_output, py_output)
+        self.assertEqual(yaml.load(c_output, Loader=yaml.CSafeLoader),
+                         yaml.load(py_output, Loader=yaml.SafeLoader))
+
+    def test_patch_travis_env_keeps_rest_of_file(self):
+        """
+            WHEN the env section is patched
+            THEN only the changed env lines differ
+            AND comments, order and formatting of the file are kept
+        """
+        text = """# build matrix for strazar
+language: python
+env:
+  # boto
+  - '_BOTO=2.45.0 _DJANGO=1.8'
+  - '_BOTO=2.45.0 _DJANGO=1.9'
+
+  # boto3
+  - '_BOTO3=1.4.3 _DJANGO=1.9'
+install:
+  - pip install Django==$_DJANGO   # the framework
+"""
+        old_travis = yaml.safe_load(text)
+        new_travis = strazar.update_travis(old_travis, 'Django', '1.10',
+                                           incremental=True,
+                                           retention={'Django': {'keep': 2}})
+        patched = strazar.patch_travis_env(text, old_travis, new_travis)
+        self.assertEqual(patched, """# build matrix for strazar
+language: python
+env:
+  # boto
+  - '_BOTO=2.45.0 _DJANGO=1.9'
+  - '_BOTO=2.45.0 _DJANGO=1.10'
+
+  # boto3
+  - '_BOTO3=1.4.3 _DJANGO=1.9'
+  - '_BOTO3=1.4.3 _DJANGO=1.10'
+install:
+  - pip install Django==$_DJANGO   # the framework
+""")
+
+    def test_patch_travis_env_not_possible(self):
+        """
+            WHEN env is not a block sequence
+            THEN patch_travis_env() returns None
+        """
+        text = "env: ['_PYYAML=3.11']\n"
+        old_travis = yaml.safe_load(text)
+        new_travis = strazar.update_travis(old_travis, 'PyYAML', '3.12')
+        self.assertIsNone(strazar.patch_travis_env(text, old_travis,
+                                                   new_travis))
+
+
+class StrazarCliTestCase(unittest.TestCase):
+    """
+        Tests for the strazar command line tool
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @staticmethod
+    def _python(*args):
+        env = dict(os.environ)
+        # allow the byte code to be cached like in a real installation
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = root
+        return subprocess.check_output((sys.executable,) + args, env=env,
+                                       stderr=subprocess.STDOUT,
+                                       cwd=root).decode('UTF-8')
+
+    def test_import_is_lazy(self):
+        """
+            WHEN strazar is imported
+            THEN YAML, networking and optional modules are not imported
+        """
+        output = self._python('-c', """
+import sys
+import strazar
+print(sorted(m for m in ('yaml', 'socket', 'ssl', 'http.client',
+                         'xmlrpc.client', 'concurrent.futures',
+                         'packaging.version', 'email.utils',
+                         'xml.etree.ElementTree', 'orjson')
+             if m in sys.modules))
+""")
+        self.assertEqual(output.strip(), '[]')
+
+    def test_matrix_preview(self):
+        """
+            WHEN the matrix command is executed
+            THEN the new env matrix is printed with the added rows marked
+        """
+        travis_file = os.path.join(self.tmp_dir, '.travis.yml')
+        with open(travis_file, 'w') as f:
+            f.write("""language: python
+env:
+  - _DJANGO=1.9 _BOTO=2.45.0
+  - _DJANGO=1.8 _BOTO=2.45.0
+""")
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            ret = strazar.cli.main(['matrix', travis_file, 'Django', '1.10'])
+
+        self.assertEqual(ret, 0)
+        self.assertEqual(stdout.getvalue(), """\
++ _BOTO=2.45.0 _DJANGO=1.10
+  _BOTO=2.45.0 _DJANGO=1.8
+  _BOTO=2.45.0 _DJANGO=1.9
+2 rows before, 3 rows after
+""")
+
+    def test_matrix_rejects_strength_below_one(self):
+        """
+            WHEN the matrix command is executed with --strength 0
+            THEN it exits with a usage error
+        """
+        travis_file = os.path.join(self.tmp_dir, '.travis.yml')
+        with open(travis_file, 'w') as f:
+            f.write("""language: python
+env:
+  - _DJANGO=1.9 _BOTO=2.45.0
+""")
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            with self.assertRaises(SystemExit) as exit_info:
+                strazar.cli.main(['matrix', travis_file, 'Django', '1.10',
+                                  '--strength', '0'])
+
+        self.assertEqual(exit_info.exception.code, 2)
+        self.assertIn('strength must be at least 1', stderr.getvalue())
+
+    def test_run_dry_run(self):
+        """
+            WHEN the run command is executed with --dry-run
+            THEN callbacks are printed instead of executed
+            AND the state file is not modified
+        """
+        config_file = os.path.join(self.tmp_dir, 'config.py')
+        with open(config_file, 'w') as f:
+            f.write("""
+def update(**kwargs):
+    raise RuntimeError('executed during dry-run')
+
+config = {
+    'PyYAML': [{'cb': update, 'args': {'GITHUB_REPO': 'MrSenko/strazar'}}],
+}
+""")
+        feed_file = os.path.join(self.tmp_dir, 'feed.xml')
+        with open(feed_file, 'w') as f:
+            f.write("""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="0.91">
+ <channel>
+  <item>
+    <title>PyYAML 3.12</title>
+    <pubDate>12 May 2016 21:45:18 GMT</pubDate>
+  </item>
+ </channel>
+</rss>""")
+        state_file = os.path.join(self.tmp_dir, 'state.json')
+
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            ret = strazar.cli.main(['run', config_file, '--feed', feed_file,
+                                    '--state-file', state_file, '--dry-run'])
+
+        self.assertEqual(ret, 0)
+        self.assertIn("dry-run: update(GITHUB_REPO='MrSenko/strazar', "
+                      "name='PyYAML', released_on=datetime.datetime(2016, 5, "
+                      "12, 21, 45, 18), version='3.12')", stdout.getvalue())
+        self.assertFalse(os.path.exists(state_file))
+
+    def test_run_changelog_requires_state_file(self):
+        """
+            WHEN the run command is executed with --changelog
+            AND without --state-file
+            THEN it exits with a usage error instead of doing nothing
+        """
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            with self.assertRaises(SystemExit) as exit_info:
+                strazar.cli.main(['run', 'config.py', '--changelog'])
+
+        self.assertEqual(exit_info.exception.code, 2)
+        self.assertIn('--changelog requires --state-file', stderr.getvalue())
+
+    def test_run_cache_dir(self):
+        """
+            WHEN the run command is executed with --cache-dir
+            THEN the HTTP cache is enabled in that directory
+        """
+        config_file = os.path.join(self.tmp_dir, 'config.py')
+        with open(config_file, 'w') as f:
+            f.write("config = {}\n")
+        feed_file = os.path.join(self.tmp_dir, 'feed.xml')
+        with open(feed_file, 'w') as f:
+            f.write('<rss version="0.91"><channel></channel></rss>')
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+        try:
+            with mock.patch('sys.stdout', new_callable=io.StringIO):
+                ret = strazar.cli.main(['run', config_file, '--feed',
+                                        feed_file, '--cache-dir', cache_dir])
+            self.assertEqual(ret, 0)
+            self.assertEqual(strazar.net._cache.path, cache_dir)
+        finally:
+            strazar.configure_http_cache(None)
+
+    def test_python_m_strazar(self):
+        """
+            WHEN strazar is executed as a module
+            THEN the command line tool is started
+        """
+        self.assertIn('usage: strazar', self._python('-m', 'strazar', '--help'))